@@ -0,0 +1,3 @@
+"""
+Tooling shared by the notebooks, the labelling application and driverapp.py
+"""
@@ -0,0 +1,177 @@
+"""
+Active-learning queue of the unlabelled images
+
+The unlabelled pool is scored offline with the multi-label model, and the
+uncertainty of every image (entropy of the per-class probabilities, or how
+close the closest class is to its threshold) is saved into a priority file.
+The labelling app keeps the file as a heap and pops the most uncertain
+unlabelled image on "Next Image". It reloads the heap whenever the file is
+rewritten, so the rescoring can keep running next to the app and refresh the
+queue after every retrain
+"""
+import argparse
+import heapq
+import os
+import time
+
+import numpy as np
+
+from .decision import load_thresholds, thresholds_path
+from .labels import LabelStore
+from .score import load_model, score_images
+
+KINDS = ("entropy", "margin")
+
+
+def uncertainty(scores, thresholds=None, kind="entropy"):
+    """
+    Uncertainty of every row of (n, classes) sigmoid scores, higher is more uncertain
+    entropy sums the binary entropy of every class, margin is minus the distance of the
+    class closest to its threshold
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if kind == "margin":
+        return -np.min(np.abs(scores - np.asarray(thresholds if thresholds is not None else 0.5)), axis=1)
+    p = np.clip(scores, 1e-7, 1 - 1e-7)
+    return -np.sum(p * np.log(p) + (1 - p) * np.log(1 - p), axis=1)
+
+
+def load_priorities(path, count):
+    """
+    Priority of every image, NaN for the images that were never scored
+    """
+    if os.path.exists(path):
+        priorities = np.load(path)
+        if len(priorities) == count:
+            return priorities
+    return np.full(count, np.nan, dtype=np.float32)
+
+
+def save_priorities(path, priorities):
+    """
+    Replace the priority file atomically so the app never reads a half-written file
+    """
+    with open(path + ".tmp", "wb") as file:
+        np.save(file, priorities)
+    os.replace(path + ".tmp", path)
+
+
+def rescore(model, model_path, store, images_format, path, kind="entropy", top=None, batch_size=512):
+    """
+    Score the unlabelled pool with model and update its priorities in path
+    With top only the top images currently in the queue (and the never scored ones) are rescored
+    Returns the number of rescored images
+    """
+    priorities = load_priorities(path, store.count)
+    pool = np.flatnonzero(~store.labelled_mask())
+    if top is not None:
+        current = np.nan_to_num(priorities[pool], nan=np.inf)
+        pool = np.sort(pool[np.argsort(-current, kind="stable")[:top]])
+    if len(pool) == 0:
+        return 0
+    scores_path = path + ".scores.npy"
+    scores = score_images(model, [images_format % i for i in pool], scores_path, batch_size, model_path=model_path)
+    thresholds = load_thresholds(thresholds_path(model_path), model.output_shape[-1])
+    priorities[pool] = uncertainty(scores, thresholds, kind)
+    del scores
+    save_priorities(path, priorities)
+    os.remove(scores_path)
+    os.remove(scores_path + ".progress.json")
+    return len(pool)
+
+
+class LabelQueue():
+    """
+    Max-heap of the unlabelled images by priority, refreshed when the priority file changes
+    Labelled images are dropped lazily when they reach the top of the heap
+    """
+
+    def __init__(self, path, store):
+        self.path = path
+        self.store = store
+        self._modified = None
+        self._heap = []
+        self.reload()
+
+    def reload(self):
+        """
+        Rebuild the heap from the priority file
+        """
+        self._modified = os.stat(self.path).st_mtime_ns
+        priorities = load_priorities(self.path, self.store.count)
+        indices = np.flatnonzero(~np.isnan(priorities) & ~self.store.labelled_mask())
+        # heapq is a min-heap, so the priorities are negated
+        self._heap = list(zip((-priorities[indices]).tolist(), indices.tolist()))
+        heapq.heapify(self._heap)
+
+    def reload_if_changed(self):
+        if os.path.exists(self.path) and os.stat(self.path).st_mtime_ns != self._modified:
+            self.reload()
+
+    def pop(self):
+        """
+        The most uncertain unlabelled image, None when the queue is empty
+        """
+        self.reload_if_changed()
+        while self._heap:
+            index = heapq.heappop(self._heap)[1]
+            if not self.store.is_labelled(index):
+                return index
+        return None
+
+    def peek(self, amount: int):
+        """
+        The next amount images pop would return, without removing them
+        Labelled images met on the way are dropped like pop does, so a peek costs O(amount log n)
+        """
+        self.reload_if_changed()
+        found = []
+        while self._heap and len(found) < amount:
+            entry = heapq.heappop(self._heap)
+            if not self.store.is_labelled(entry[1]):
+                found.append(entry)
+        for entry in found:
+            heapq.heappush(self._heap, entry)
+        return [index for priority, index in found]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank the unlabelled images by model uncertainty for the labelling app")
+    parser.add_argument("model", help="multi-label .h5 or .tflite model")
+    parser.add_argument("--labels", default="../data/labels.csv")
+    parser.add_argument("--images", default="../data/images/%d.jpeg", help="image path format")
+    parser.add_argument("--count", type=int, default=54108, help="number of images in the corpus")
+    parser.add_argument("--label-count", type=int, default=11)
+    parser.add_argument("--output", default="../data/uncertainty.npy", help="priority file read by the labelling app")
+    parser.add_argument("--kind", choices=KINDS, default="entropy")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--top", type=int, default=2000, help="queued images rescored first when the model changes")
+    parser.add_argument("--watch", type=float, help="keep running and rescore every time the model file changes, polling every WATCH seconds")
+    args = parser.parse_args()
+
+    modified = None
+    while True:
+        current = os.stat(args.model).st_mtime_ns
+        if current != modified:
+            retrained = modified is not None
+            modified = current
+            model = load_model(args.model)
+            store = LabelStore.from_csv(args.labels, args.label_count, args.count)
+            if retrained:
+                # The front of the queue is what the labeller sees next, so it is refreshed first
+                started = time.perf_counter()
+                count = rescore(model, args.model, store, args.images, args.output, args.kind, args.top, args.batch_size)
+                print("Rescored the top %d queued images in %.1fs" % (count, time.perf_counter() - started))
+            started = time.perf_counter()
+            count = rescore(model, args.model, store, args.images, args.output, args.kind, None, args.batch_size)
+            print("Scored %d unlabelled images in %.1fs" % (count, time.perf_counter() - started))
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Selenium driver for the reCAPTCHA demo page used by driverapp.py
+
+Kept out of driverapp.py so selenium and pyautogui are only imported once a
+browser is actually opened
+"""
+import urllib.request
+import pyautogui
+from time import sleep
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from PIL import Image
+
+from .build import process_image
+from .profiling import stage
+from .tiling import tile_grid
+
+
+class WebDriver(webdriver.Chrome):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._attempts = 0
+        self._local_click_count = 0
+        self._click_count = 0
+        self.reload_counter = 0
+        self._clicked = []
+        self.get("https://www.google.com/recaptcha/api2/demo")
+        self.fullscreen_window()
+        self.find_element_by_css_selector('[title="reCAPTCHA"]').click()
+        self.iframe = self.find_element_by_css_selector('[title="recaptcha challenge expires in two minutes"]')
+        self.iframe = WebDriverWait(self, 10).until(EC.visibility_of(self.iframe))
+        self.boxX = self.iframe.location["x"]
+        self.boxY = self.iframe.location["y"] + 45
+        self.switch_to.frame(self.iframe)
+        self.verifyX, self.verifyY = self._find_coordinates_of_element(self.find_element_by_id("recaptcha-verify-button"))
+        self.reloadX, self.reloadY = self._find_coordinates_of_element(self.find_element_by_id("recaptcha-reload-button"))
+        self.reloadY += 10
+        self.verifyY += 10
+        self.initialize()
+        self.table_coords = [self._find_coordinates_of_element(i) for i in self.find_elements_by_tag_name("td")]
+
+    def initialize(self):
+        """
+        Finds a 3x3 box and downloads the original image
+        """
+        self._click_count = 0
+        self._local_click_count = 0
+        self._find_3x3_box()
+        if self.reload_counter > 7:
+            return
+        with stage("io/download"):
+            urllib.request.urlretrieve(self.find_element_by_class_name("rc-image-tile-33").get_attribute("src"), "./data/solver/captcha.jpeg")
+        self.images = self._crop_image_and_convert(Image.open("./data/solver/captcha.jpeg"))
+
+    def new_challenge(self):
+        """
+        Reload the challenge and download the new grid
+        """
+        self._reload()
+        self.initialize()
+
+    def get_captcha_label(self, labels):
+        label_text = self.find_element_by_tag_name("strong").text
+        for i in labels:
+            if label_text in i:
+                return labels.index(i)
+
+    def click_box(self, index):
+        """
+        Click the captcha grid box based on the index passed
+        adds to click counter
+        """
+        self._click_count += 1
+        self._local_click_count += 1
+        # self.find_elements_by_tag_name("td")[index].click()
+        self._click(*self.table_coords[index])
+        self._clicked.append(index)
+        
+    def update_image(self):
+        print("DEBUG =", self._clicked)
+        for index in self._clicked:
+            img_element = self.find_elements_by_tag_name("td")[index].find_element_by_class_name("rc-image-tile-11")
+            file_path = "./data/solver/captcha-tile-%d.jpeg" % index
+            with stage("io/download"):
+                urllib.request.urlretrieve(img_element.get_attribute("src"), file_path)
+            with stage("decode"), Image.open(file_path) as image:
+                self.images[index] = process_image(image)
+        self._clicked = []
+
+    def submit(self, label):
+        """
+        Click the verify button, then checks if the attempt was successful
+        if unsuccessful reinitializes and returns None
+        if successful, return the attempts count
+        """
+        self._attempts += 1
+        self._click(self.verifyX, self.verifyY)
+        # self.find_element_by_id("recaptcha-verify-button").click()
+        sleep(3)
+
+        if self._check_success() is True:
+            print("PASSED ON [%s]" % label)
+            return self._attempts
+        else:
+            if self._local_click_count <= 3:
+                self._reload()
+                print("DEBUG RELOAD")
+            self.initialize()
+            return None
+    
+    def _find_3x3_box(self):
+        """
+        Loop until 3x3 CAPTCHA is found
+        """
+        # Check if there are any elements with rc-image-tile-33
+        img_element = self._check_images()
+        while img_element is None:
+            if self.reload_counter > 7:
+                return
+            self._reload()
+            self.reload_counter += 1
+            img_element = self._check_images()
+        self.reload_counter = 0
+
+    def _crop_image_and_convert(self, image):
+        """
+        Split the 3x3 CAPTCHA image into a (9, 100, 100, 3) array of tiles
+        """
+        return tile_grid(image, 3)
+
+    def _click(self, x, y):
+        pyautogui.moveTo(x, y, 0.5)
+        pyautogui.click()
+
+    def _reload(self):
+        self._click(self.reloadX, self.reloadY)
+        # self.find_element_by_id("recaptcha-reload-button").click()
+        sleep(1)
+
+    def _find_coordinates_of_element(self, element):
+        """
+        Used to find the coordinates of an element for pyautogui to click
+        """
+        x = self.boxX + element.size["width"] / 2 + element.location["x"]
+        y = self.boxY + element.size["height"] / 2 + element.location["y"]
+        return x, y
+    
+    def _check_images(self):
+        images = self.find_elements_by_tag_name("img")
+        for i in images:
+            if i.get_attribute("class") == "rc-image-tile-33":
+                return i
+            
+    def _check_success(self):
+        """
+        Used to check if the captcha verification is successful
+        True if yes
+        """
+        self.switch_to.default_content()
+        self.switch_to.frame(self.find_element_by_css_selector('[title="reCAPTCHA"]'))
+        checker = self.find_elements_by_css_selector('[aria-checked="true"]')
+        if len(checker) == 0:
+            self.switch_to.default_content()
+            self.switch_to.frame(self.find_element_by_css_selector('[title="recaptcha challenge expires in two minutes"]'))
+            return False
+        else:
+            self.switch_to.default_content()
+            return True
+            
+    def challenge_open(self):
+        """
+        Whether the challenge is still shown, it closes once the CAPTCHA is passed
+        """
+        return len(self.find_elements_by_tag_name("span")) > 0
+
+    def get_images(self):
+        return self.images
+    
+    def get_click_count(self):
+        return self._click_count
+    
+    def set_click_count(self, count):
+        self._click_count = count
+    
+    def get_attempts(self):
+        return self._attempts
+
+    def wait_for_tiles(self):
+        """
+        Wait until the clicked tiles have been replaced by new images
+        """
+        WebDriverWait(self, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "rc-image-tile-11")))
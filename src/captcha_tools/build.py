@@ -0,0 +1,142 @@
+"""
+Build image_data.npy / label_data.npy from data/images in a single streaming pass
+
+The inputs are counted first so the output can be preallocated as a
+memory-mapped (N, 100, 100, 3) uint8 array on disk, which keeps memory usage
+bounded no matter how many images there are.
+Decoding can be sharded across processes that write directly into the output
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .shards import write_shards
+
+IMAGE_SHAPE = (100, 100, 3)
+
+
+def process_image(img):
+    """
+    Process an image into a shape of (100, 100, 3)
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != IMAGE_SHAPE[:2]:
+        img = img.resize(IMAGE_SHAPE[:2])
+    return np.asarray(img, dtype=np.uint8)
+
+
+def _image_key(filename):
+    """
+    Sort numbered images (0.jpeg, 1.jpeg, ...) numerically, anything else by name
+    """
+    stem = os.path.splitext(filename)[0]
+    return (0, int(stem), "") if stem.isdigit() else (1, 0, stem)
+
+
+def list_images(directory):
+    """
+    List the images to build the dataset from
+    Returns (paths, categories, label_names)
+
+    If the directory contains one folder per label (single-label layout),
+    categories holds the label index of every image.
+    Otherwise the directory is treated as a flat numbered image folder and
+    categories is None
+    """
+    folders = sorted(i for i in os.listdir(directory) if os.path.isdir(os.path.join(directory, i)))
+    if not folders:
+        files = sorted((i for i in os.listdir(directory) if i.lower().endswith((".jpeg", ".jpg", ".png"))), key=_image_key)
+        return [os.path.join(directory, i) for i in files], None, []
+    paths = []
+    categories = []
+    for index, label in enumerate(folders):
+        current_directory = os.path.join(directory, label)
+        for i in sorted(os.listdir(current_directory), key=_image_key):
+            paths.append(os.path.join(current_directory, i))
+            categories.append(index)
+    return paths, categories, folders
+
+
+def _decode_shard(image_path, paths, positions, flips):
+    """
+    Decode a shard of images into their positions of the memory-mapped image_path
+    Runs inside a worker process, each worker opens its own view of the output
+    """
+    images = np.load(image_path, mmap_mode="r+")
+    for path, position, flip in zip(paths, positions, flips):
+        with Image.open(path) as raw:
+            images[position] = process_image(raw)
+        if flip:
+            images[position + 1] = images[position, :, ::-1]
+    images.flush()
+    return len(paths)
+
+
+def build_dataset(directory, image_path, label_path=None, flip_chance=0.0, seed=0, workers=None, shard_size=1024):
+    """
+    Decode every image in directory straight into a memory-mapped image_path
+    and save the one-hot encoded categories into label_path
+
+    flip_chance adds a horizontally flipped copy of an image with that probability,
+    the flips are drawn up front from seed so the output size is known before decoding
+    (training augments on the fly through captcha_tools.pipeline, so this is off by default)
+    workers > 1 shards the file list across that many processes (all CPUs when None), every
+    image has a fixed output position so the result is identical for any number of workers
+    Returns the (memory-mapped) image array and the label array
+    """
+    paths, categories, label_names = list_images(directory)
+    flips = np.random.default_rng(seed).random(len(paths)) < flip_chance
+    positions = np.arange(len(paths)) + np.cumsum(flips) - flips
+    count = len(paths) + int(flips.sum())
+
+    images = np.lib.format.open_memmap(image_path, mode="w+", dtype=np.uint8, shape=(count,) + IMAGE_SHAPE)
+    del images
+    shards = [
+        (image_path, paths[i:i + shard_size], positions[i:i + shard_size], flips[i:i + shard_size])
+        for i in range(0, len(paths), shard_size)
+    ]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(_decode_shard, *shard) for shard in shards]:
+                future.result()
+    else:
+        for shard in shards:
+            _decode_shard(*shard)
+
+    labels = None
+    if categories is not None:
+        labels = np.zeros((count, len(label_names)), dtype=np.float32)
+        labels[np.arange(count), np.repeat(categories, 1 + flips)] = 1.0
+        if label_path:
+            np.save(label_path, labels)
+    return np.load(image_path, mmap_mode="r"), labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build image_data.npy and label_data.npy from an image folder")
+    parser.add_argument("--images", default="../data/images", help="image folder, either flat or one folder per label")
+    parser.add_argument("--image-out", default="image_data.npy")
+    parser.add_argument("--label-out", default="label_data.npy")
+    parser.add_argument("--flip-chance", type=float, default=0.0, help="chance of adding a flipped copy of each image")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of decoding processes")
+    parser.add_argument("--shards", help="also write the dataset in the sharded format into this directory")
+    args = parser.parse_args()
+
+    images, labels = build_dataset(args.images, args.image_out, args.label_out, args.flip_chance, args.seed, args.workers)
+    print("images:", images.shape)
+    if labels is not None:
+        print("labels:", labels.shape)
+        if args.shards:
+            index = write_shards(images, labels, args.shards, label_names=list_images(args.images)[2])
+            print("shards:", len(index["shards"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Per-class threshold calibration for the multi-label model
+
+The model is run once over the labelled part of labels.csv and the probabilities
+are cached. The classes of the model are matched to the labels.csv columns by
+name, like compare.evaluate does. Every class is then swept over a grid of
+thresholds using sorted scores and cumulative true positive counts, so the sweep
+never re-runs the model and thousands of thresholds take milliseconds
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .compare import LABEL_NAMES, MODELS
+from .decision import save_thresholds, thresholds_path
+from .labels import LabelStore
+from .score import load_model, model_output_path, score_images
+
+
+def sweep(scores, truth, thresholds):
+    """
+    Precision, recall and F1 of one class at every threshold (predicted positive = score >= threshold)
+    scores and truth are (n,) arrays, returns three (len(thresholds),) arrays
+    """
+    order = np.argsort(scores, kind="stable")
+    sorted_scores = scores[order]
+    # true_above[k] = positives among the scores from position k upwards
+    true_above = np.concatenate((np.cumsum(truth[order][::-1])[::-1], [0]))
+    first = np.searchsorted(sorted_scores, thresholds, side="left")
+    predicted = len(scores) - first
+    true_positives = true_above[first]
+    positives = true_above[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, true_positives / predicted, 1.0)
+        recall = np.where(positives > 0, true_positives / positives, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return precision, recall, f1
+
+
+def best_thresholds(scores, truth, thresholds):
+    """
+    Threshold with the highest F1 for every class of (n, classes) scores and truth
+    Returns the thresholds and the precision, recall and F1 reached with them
+    """
+    classes = scores.shape[1]
+    best = np.zeros(classes)
+    metrics = np.zeros((3, classes))
+    for label in range(classes):
+        precision, recall, f1 = sweep(scores[:, label], truth[:, label].astype(np.int64), thresholds)
+        position = int(np.argmax(f1))
+        best[label] = thresholds[position]
+        metrics[:, label] = precision[position], recall[position], f1[position]
+    return best, metrics
+
+
+def truth_columns(label_names):
+    """
+    labels.csv column of every model class, by name
+    """
+    missing = [name for name in label_names if name not in LABEL_NAMES]
+    if missing:
+        raise ValueError("labels.csv has no column for %s" % ", ".join(missing))
+    return [LABEL_NAMES.index(name) for name in label_names]
+
+
+def labelled_scores(model_path, labels_path, images_format, cache_path, label_names, batch_size=512, prediction_cache=None):
+    """
+    Cached model probabilities and the matching (n, classes) label matrix of every labelled image
+    """
+    store = LabelStore.from_csv(labels_path, len(LABEL_NAMES))
+    indices = np.flatnonzero(store.labelled_mask())
+    model = load_model(model_path, cache_path=prediction_cache)
+    if model.output_shape[-1] != len(label_names):
+        raise ValueError("%s has %d classes, expected %d" % (model_path, model.output_shape[-1], len(label_names)))
+    scores = score_images(model, [images_format % i for i in indices], cache_path, batch_size, model_path=model_path)
+    return np.asarray(scores), store.matrix(indices)[:, truth_columns(label_names)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate per-class thresholds of the multi-label model")
+    parser.add_argument("model", help="path to the multi-label .h5 model")
+    parser.add_argument("--labels", default="../data/labels.csv")
+    parser.add_argument("--images", default="../data/images/%d.jpeg", help="image path format")
+    parser.add_argument("--cache", help="probability cache, defaults to <model>_calibration.npy")
+    parser.add_argument("--steps", type=int, default=1000, help="thresholds to sweep between 0 and 1")
+    parser.add_argument("--output", help="calibration file, defaults to <model>_thresholds.json")
+    parser.add_argument("--prediction-cache", help="sqlite prediction cache shared between runs")
+    args = parser.parse_args()
+
+    cache_path = args.cache or model_output_path(args.model, "_calibration.npy")
+    label_names = MODELS["multi"]["label_names"]
+    scores, truth = labelled_scores(args.model, args.labels, args.images, cache_path, label_names, prediction_cache=args.prediction_cache)
+
+    thresholds = np.linspace(0, 1, args.steps + 1)[1:]
+    started = time.perf_counter()
+    best, (precision, recall, f1) = best_thresholds(scores, truth, thresholds)
+    print("Swept %d thresholds x %d classes over %d images in %.1fms" % (
+        len(thresholds), scores.shape[1], len(scores), (time.perf_counter() - started) * 1000))
+    for label, name in enumerate(label_names):
+        print("%-14s threshold %.3f precision %.3f recall %.3f f1 %.3f" % (name, best[label], precision[label], recall[label], f1[label]))
+
+    output = args.output or thresholds_path(args.model)
+    save_thresholds(output, best, label_names, precision=precision.tolist(), recall=recall.tolist(), f1=f1.tolist())
+    print("Thresholds written to %s" % output)
+
+
+if __name__ == "__main__":
+    main()
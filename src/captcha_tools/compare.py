@@ -0,0 +1,258 @@
+"""
+Offline comparison of the single-label and the multi-label model
+
+Both models are scored over the labelled part of labels.csv and judged with the
+same decision code the solver uses (argmax for the single-label model, calibrated
+thresholds for the multi-label one). The classes of each model are matched to the
+labels.csv classes by name. Next to per-class accuracy, precision, recall and F1
+the CPU latency percentiles and throughput are measured at several batch sizes.
+The exported int8 .tflite models can be run alongside to see what quantization
+costs in accuracy and gains in latency. A run is written as JSON and two runs
+can be diffed to catch regressions
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from .build import IMAGE_SHAPE, process_image
+from .decision import decide, model_thresholds
+from .labels import LabelStore
+from .score import load_model, model_output_path, score_images
+
+LABEL_NAMES = [
+    'Bicycle', 'Bridge', 'Bus', 'Car', 'Crosswalk',
+    'Hydrant', 'Motorcycle', 'Stairs', 'Tractors',
+    'Traffic Light', 'Other'
+]
+MODELS = {
+    "single": {
+        "path": "../data/solver/singlelabel_model.h5",
+        "single_label": True,
+        # The solver calls Stairs "Stair" for this model
+        "label_names": [
+            'Bicycle', 'Bridge', 'Bus', 'Car', 'Chimney',
+            'Crosswalk', 'Hydrant', 'Motorcycle', 'Other', 'Palm', 'Stairs',
+            'Traffic Light'
+        ],
+    },
+    "multi": {
+        "path": "../data/solver/multilabel_model.h5",
+        "single_label": False,
+        "label_names": [
+            'Bicycle', 'Bridge', 'Bus', 'Car', 'Crosswalk',
+            'Hydrant', 'Motorcycle', 'Stairs',
+            'Traffic Light'
+        ],
+    },
+}
+BATCH_SIZES = (1, 9, 32, 128)
+# Higher is better for the quality metrics, lower is better for latency
+QUALITY_METRICS = ("accuracy", "precision", "recall", "f1")
+
+
+def class_metrics(decisions, truth):
+    """
+    Accuracy, precision, recall and F1 of every column of (n, classes) boolean decisions and truth
+    """
+    truth = np.asarray(truth, dtype=bool)
+    true_positives = np.sum(decisions & truth, axis=0)
+    false_positives = np.sum(decisions & ~truth, axis=0)
+    false_negatives = np.sum(~decisions & truth, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(true_positives + false_positives > 0, true_positives / (true_positives + false_positives), 1.0)
+        recall = np.where(true_positives + false_negatives > 0, true_positives / (true_positives + false_negatives), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {
+        "accuracy": np.mean(decisions == truth, axis=0),
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "support": np.sum(truth, axis=0),
+    }
+
+
+def evaluate(scores, truth, model_names, thresholds, single_label):
+    """
+    Per-class metrics of a model over the labels.csv classes it shares with the dataset
+    """
+    decisions = decide(scores, thresholds, single_label)
+    shared = [name for name in LABEL_NAMES if name in model_names]
+    columns = [model_names.index(name) for name in shared]
+    metrics = class_metrics(decisions[:, columns], truth[:, [LABEL_NAMES.index(name) for name in shared]])
+    result = {}
+    for position, name in enumerate(shared):
+        result[name] = {key: float(value[position]) for key, value in metrics.items()}
+    result["macro"] = {key: float(np.mean(metrics[key])) for key in QUALITY_METRICS}
+    return result
+
+
+def measure_latency(model, images, batch_sizes=BATCH_SIZES, repeat=50):
+    """
+    Latency percentiles in milliseconds and images/sec of model.predict at every batch size
+    """
+    result = {}
+    for batch_size in batch_sizes:
+        batch = np.resize(images, (batch_size,) + images.shape[1:])
+        model.predict(batch, batch_size=batch_size, verbose=0)
+        timings = np.empty(repeat)
+        for i in range(repeat):
+            started = time.perf_counter()
+            model.predict(batch, batch_size=batch_size, verbose=0)
+            timings[i] = time.perf_counter() - started
+        p50, p95, p99 = np.percentile(timings * 1000, [50, 95, 99])
+        result[str(batch_size)] = {
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "images_per_sec": float(batch_size / np.median(timings)),
+        }
+    return result
+
+
+def run(models, labels_path, images_format, batch_sizes=BATCH_SIZES, repeat=50):
+    """
+    Score and time every (name, path) in models, returns the JSON-ready run
+    A name like "multi-int8" is judged with the configuration of "multi"
+    """
+    store = LabelStore.from_csv(labels_path, len(LABEL_NAMES))
+    indices = np.flatnonzero(store.labelled_mask())
+    truth = store.matrix(indices)
+    paths = [images_format % i for i in indices]
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": sys.version.split()[0], "cpus": os.cpu_count()},
+        "images": len(indices),
+        "models": {},
+    }
+    for name, model_path in models:
+        config = MODELS[name.split("-")[0]]
+        model = load_model(model_path)
+        if model.output_shape[-1] != len(config["label_names"]):
+            raise ValueError("%s has %d classes, expected %d" % (model_path, model.output_shape[-1], len(config["label_names"])))
+        # Keyed on the model file hash, so a retrained model of the same name is scored again
+        scores = np.asarray(score_images(model, paths, model_output_path(model_path, "_compare.npy"), model_path=model_path))
+        thresholds = model_thresholds(model_path, len(config["label_names"]), not config["single_label"])
+        result["models"][name] = {
+            "path": model_path,
+            "classes": evaluate(scores, truth, config["label_names"], thresholds, config["single_label"]),
+            "latency": measure_latency(model, sample_images(paths, max(batch_sizes)), batch_sizes, repeat),
+        }
+    return result
+
+
+def sample_images(paths, count):
+    """
+    The first count images decoded into one batch for the latency measurements
+    """
+    batch = np.empty((min(count, len(paths)),) + IMAGE_SHAPE, dtype=np.uint8)
+    for i, path in enumerate(paths[:len(batch)]):
+        with Image.open(path) as raw:
+            batch[i] = process_image(raw)
+    return batch
+
+
+def diff(old, new, metric_tolerance=0.01, latency_tolerance=0.2):
+    """
+    Regressions of the new run against the old one
+    A quality metric regresses when it drops by more than metric_tolerance, a latency
+    percentile when it grows by more than latency_tolerance (a fraction of the old value)
+    """
+    regressions = []
+    for name, model in new["models"].items():
+        if name not in old["models"]:
+            continue
+        previous = old["models"][name]
+        for label, metrics in model["classes"].items():
+            for key in QUALITY_METRICS:
+                before = previous["classes"].get(label, {}).get(key)
+                if before is not None and metrics[key] < before - metric_tolerance:
+                    regressions.append("%s %s %s: %.3f -> %.3f" % (name, label, key, before, metrics[key]))
+        for batch_size, timings in model["latency"].items():
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                before = previous["latency"].get(batch_size, {}).get(key)
+                if before is not None and timings[key] > before * (1 + latency_tolerance):
+                    regressions.append("%s batch %s %s: %.2f -> %.2f" % (name, batch_size, key, before, timings[key]))
+    return regressions
+
+
+def print_run(result):
+    """
+    Print the per-class metrics and the latencies of a run
+    """
+    for name, model in result["models"].items():
+        print("%s (%s)" % (name, model["path"]))
+        for label, metrics in model["classes"].items():
+            print("  %-14s accuracy %.3f precision %.3f recall %.3f f1 %.3f" % (
+                label, metrics["accuracy"], metrics["precision"], metrics["recall"], metrics["f1"]))
+        for batch_size, timings in model["latency"].items():
+            print("  batch %4s: p50 %.2fms p95 %.2fms p99 %.2fms, %.1f images/sec" % (
+                batch_size, timings["p50_ms"], timings["p95_ms"], timings["p99_ms"], timings["images_per_sec"]))
+
+
+def print_deltas(result):
+    """
+    Print the F1 and latency of every quantized model next to its .h5
+    """
+    for name, model in result["models"].items():
+        if not name.endswith("-int8") or name[:-5] not in result["models"]:
+            continue
+        original = result["models"][name[:-5]]
+        print("%s vs %s" % (name, name[:-5]))
+        for label, metrics in model["classes"].items():
+            print("  %-14s f1 %.3f vs %.3f (%+.3f)" % (label, metrics["f1"], original["classes"][label]["f1"], metrics["f1"] - original["classes"][label]["f1"]))
+        for batch_size, timings in model["latency"].items():
+            before = original["latency"][batch_size]
+            print("  batch %4s: p50 %.2fms vs %.2fms (%.2fx faster)" % (
+                batch_size, timings["p50_ms"], before["p50_ms"], before["p50_ms"] / timings["p50_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the single-label and multi-label models offline")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="score and time the models over the labelled images")
+    run_parser.add_argument("--single", default=MODELS["single"]["path"], help="single-label .h5 model")
+    run_parser.add_argument("--multi", default=MODELS["multi"]["path"], help="multi-label .h5 model")
+    run_parser.add_argument("--labels", default="../data/labels.csv")
+    run_parser.add_argument("--images", default="../data/images/%d.jpeg", help="image path format")
+    run_parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BATCH_SIZES))
+    run_parser.add_argument("--repeat", type=int, default=50, help="timed predictions per batch size")
+    run_parser.add_argument("--quantized", action="store_true", help="also run the exported .tflite next to each model")
+    run_parser.add_argument("--output", default="../data/multiresult/comparison.json")
+    diff_parser = commands.add_parser("diff", help="list the regressions of a run against a baseline run")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("--metric-tolerance", type=float, default=0.01)
+    diff_parser.add_argument("--latency-tolerance", type=float, default=0.2, help="allowed latency growth as a fraction")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        models = [("single", args.single), ("multi", args.multi)]
+        if args.quantized:
+            models += [(name + "-int8", os.path.splitext(path)[0] + ".tflite") for name, path in models]
+        result = run(models, args.labels, args.images, args.batch_sizes, args.repeat)
+        print_run(result)
+        print_deltas(result)
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=1)
+        print("Comparison written to %s" % args.output)
+        return
+
+    with open(args.old, "r") as file:
+        old = json.load(file)
+    with open(args.new, "r") as file:
+        new = json.load(file)
+    regressions = diff(old, new, args.metric_tolerance, args.latency_tolerance)
+    for line in regressions:
+        print(line)
+    print("%d regressions" % len(regressions))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Turn model predictions into tile decisions
+
+Works on any batch of (..., classes) predictions: single-label models keep only
+the argmax score of each tile, multi-label models compare every class against
+its own threshold. Thresholds of multi-label models are loaded from a
+calibration file, single-label models always use DEFAULT_THRESHOLD. driverapp.py,
+compare.py and the mock CAPTCHA harness all pick them through model_thresholds
+"""
+import json
+import numbers
+import os
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.2
+
+
+def argmax_mask(predictions):
+    """
+    Zero every score except the highest one of each prediction
+    """
+    predictions = np.asarray(predictions)
+    keep = np.arange(predictions.shape[-1]) == np.argmax(predictions, axis=-1)[..., None]
+    return np.where(keep, predictions, 0.0).astype(predictions.dtype)
+
+
+def decide(predictions, thresholds, single_label=False):
+    """
+    Boolean (..., classes) decisions, thresholds is a scalar or one value per class
+    """
+    if single_label:
+        predictions = argmax_mask(predictions)
+    return np.asarray(predictions) >= np.asarray(thresholds)
+
+
+def tiles_to_click(predictions, label: int, thresholds, single_label=False):
+    """
+    Indices of the tiles predicted to contain label
+    Raises ValueError when label is not a class of predictions, e.g. None for an unknown challenge
+    """
+    predictions = np.asarray(predictions)
+    if not isinstance(label, numbers.Integral) or isinstance(label, bool) or not 0 <= label < predictions.shape[-1]:
+        raise ValueError("label %r is not one of the %d classes" % (label, predictions.shape[-1]))
+    thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float64), predictions.shape[-1:])
+    return np.flatnonzero(decide(predictions, thresholds, single_label)[:, label])
+
+
+def load_thresholds(path, label_count: int, default=DEFAULT_THRESHOLD):
+    """
+    Per-class thresholds from a calibration file, default for every class if there is none
+    """
+    if path is None or not os.path.exists(path):
+        return np.full(label_count, default)
+    with open(path, "r") as file:
+        thresholds = np.asarray(json.load(file)["thresholds"], dtype=np.float64)
+    if len(thresholds) != label_count:
+        raise ValueError("%s has %d thresholds, the model has %d classes" % (path, len(thresholds), label_count))
+    return thresholds
+
+
+def model_thresholds(model_path, class_count: int, multi_label: bool):
+    """
+    Thresholds the solver uses for a model: the calibrated ones (DEFAULT_THRESHOLD until
+    calibrated) for a multi-label model, DEFAULT_THRESHOLD for every class of a single-label one
+    """
+    if not multi_label:
+        return np.full(class_count, DEFAULT_THRESHOLD)
+    return load_thresholds(thresholds_path(model_path), class_count)
+
+
+def save_thresholds(path, thresholds, label_names=None, **details):
+    """
+    Write a calibration file, extra details (e.g. the F1 per class) are stored alongside
+    """
+    content = {"thresholds": [float(i) for i in thresholds]}
+    if label_names is not None:
+        content["label_names"] = list(label_names)
+    content.update(details)
+    with open(path, "w") as file:
+        json.dump(content, file, indent=1)
+
+
+def thresholds_path(model_path):
+    """
+    Calibration file that belongs to a model, e.g. multilabel_model_thresholds.json
+    """
+    return os.path.splitext(model_path)[0] + "_thresholds.json"
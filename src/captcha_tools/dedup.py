@@ -0,0 +1,240 @@
+"""
+Near-duplicate detection over the image corpus
+
+Every image gets a 64-bit dHash (is each pixel of a 9x8 grayscale thumbnail
+brighter than its right neighbour). Pairs within a Hamming radius are found with
+multi-index hashing: the hash is cut into radius + 1 chunks, and by the
+pigeonhole principle any two hashes within the radius agree exactly on one
+chunk, so only images sharing a chunk value are compared. Pairs are merged into
+clusters, which drive the dedup report and a split that keeps every cluster on
+one side
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+DEFAULT_RADIUS = 6
+# Number of set bits of every byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    64-bit difference hash of a PIL image or an (height, width, 3) uint8 array
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(np.asarray(image))
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return np.packbits(bits).view(">u8")[0].astype(np.uint64)
+
+
+def hash_array(images):
+    """
+    dHash of every image of an (n, height, width, 3) array (or a ShardedDataset-like sequence)
+    """
+    return np.array([dhash(images[i]) for i in range(len(images))], dtype=np.uint64)
+
+
+def _hash_files(paths):
+    hashes = np.empty(len(paths), dtype=np.uint64)
+    for i, path in enumerate(paths):
+        with Image.open(path) as image:
+            hashes[i] = dhash(image)
+    return hashes
+
+
+def hash_files(paths, workers=1, shard_size=1024):
+    """
+    dHash of every image file, decoded across workers processes
+    """
+    chunks = [paths[i:i + shard_size] for i in range(0, len(paths), shard_size)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(_hash_files, chunks))
+    else:
+        results = [_hash_files(chunk) for chunk in chunks]
+    return np.concatenate(results) if results else np.zeros(0, dtype=np.uint64)
+
+
+def source_key(paths):
+    """
+    sha256 over the ordered paths with their sizes and modification times, a cached hash
+    array is only valid for the same key
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(("%s\0%d\0%d\n" % (path, stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+
+def load_cached_hashes(hash_path, key):
+    """
+    The cached hashes when they were computed from the same source, otherwise None
+    """
+    if not os.path.exists(hash_path) or not os.path.exists(hash_path + ".json"):
+        return None
+    with open(hash_path + ".json", "r") as file:
+        if json.load(file).get("source") != key:
+            return None
+    return np.load(hash_path)
+
+
+def save_cached_hashes(hash_path, key, hashes):
+    np.save(hash_path, hashes)
+    with open(hash_path + ".json", "w") as file:
+        json.dump({"source": key, "count": len(hashes)}, file)
+
+
+def hamming(a, b):
+    """
+    Element-wise Hamming distance of two uint64 arrays
+    """
+    difference = np.ascontiguousarray(np.bitwise_xor(a, b))
+    return _POPCOUNT[difference.view(np.uint8)].reshape(difference.shape + (8,)).sum(axis=-1)
+
+
+def near_duplicate_pairs(hashes, radius=DEFAULT_RADIUS, block=1024):
+    """
+    Every (i, j) pair with i < j whose hashes differ in at most radius bits, as an (k, 2) array
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    bounds = np.linspace(0, 64, radius + 2).astype(int)
+    pairs = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        keys = (hashes >> np.uint64(start)) & np.uint64((1 << int(end - start)) - 1)
+        order = np.argsort(keys, kind="stable")
+        values, first, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        for offset, count in zip(first[counts > 1], counts[counts > 1]):
+            members = np.sort(order[offset:offset + count])
+            # Compare the bucket in blocks of rows so a huge bucket (e.g. blank tiles) stays bounded in memory
+            for row in range(0, count - 1, block):
+                rows = members[row:row + block]
+                distances = hamming(hashes[rows][:, None], hashes[members][None, :])
+                a, b = np.nonzero(distances <= radius)
+                keep = rows[a] < members[b]
+                pairs.append(np.stack((rows[a][keep], members[b][keep]), axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    # A pair that agrees on several chunks is found once per chunk
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def cluster(count, pairs):
+    """
+    Cluster id of every image, the smallest index of the cluster it belongs to
+    """
+    groups = np.arange(count)
+    if len(pairs) == 0:
+        return groups
+    a, b = pairs[:, 0], pairs[:, 1]
+    while True:
+        # Hook both ends of every pair to the smaller root, then flatten the trees
+        lowest = np.minimum(groups[a], groups[b])
+        previous = groups.copy()
+        np.minimum.at(groups, groups[a], lowest)
+        np.minimum.at(groups, groups[b], lowest)
+        while True:
+            jumped = groups[groups]
+            if np.array_equal(jumped, groups):
+                break
+            groups = jumped
+        if np.array_equal(groups, previous):
+            return groups
+
+
+def group_split(groups, test_size=0.2, seed=69):
+    """
+    Split indices into (train, test) index arrays where every cluster lands on one side
+    Clusters are shuffled and assigned to the test split until it holds test_size of the images
+    """
+    groups = np.asarray(groups)
+    ids, inverse, counts = np.unique(groups, return_inverse=True, return_counts=True)
+    order = np.random.default_rng(seed).permutation(len(ids))
+    target = int(round(len(groups) * test_size))
+    test_clusters = order[:np.searchsorted(np.cumsum(counts[order]), target) + 1] if target else order[:0]
+    in_test = np.zeros(len(ids), dtype=bool)
+    in_test[test_clusters] = True
+    test = in_test[inverse]
+    return np.flatnonzero(~test), np.flatnonzero(test)
+
+
+def report(groups, names=None, largest=20):
+    """
+    Summary of the duplicate clusters with the members of the largest ones
+    """
+    ids, counts = np.unique(groups, return_counts=True)
+    duplicated = ids[counts > 1]
+    sizes = counts[counts > 1]
+    members = []
+    for group in duplicated[np.argsort(-sizes, kind="stable")][:largest]:
+        indices = np.flatnonzero(groups == group)
+        members.append([names[i] for i in indices] if names is not None else indices.tolist())
+    return {
+        "images": int(len(groups)),
+        "unique": int(len(ids)),
+        "duplicate_images": int(len(groups) - len(ids)),
+        "clusters": int(len(duplicated)),
+        "largest_cluster": int(sizes.max()) if len(sizes) else 1,
+        "largest_clusters": members,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate images and cluster them")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--images", default="../data/images", help="image folder, either flat or one folder per label")
+    source.add_argument("--shards", help="sharded dataset directory, writes groups.npy into it for duplicate-aware splits")
+    parser.add_argument("--radius", type=int, default=DEFAULT_RADIUS, help="largest Hamming distance counted as a duplicate")
+    parser.add_argument("--hashes", help="hash cache, defaults to dhash.npy next to the images, recomputed when any image changes")
+    parser.add_argument("--report", default="../data/dedup_report.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.shards:
+        from .shards import GROUPS_FILE, ShardedDataset
+        dataset = ShardedDataset(args.shards)
+        names = None
+        hash_path = args.hashes or os.path.join(args.shards, "dhash.npy")
+        # Every shard file, leaving out what dedup writes into the directory itself
+        sources = sorted(os.path.join(args.shards, name) for name in os.listdir(args.shards)
+                         if not name.startswith(("dhash.npy", GROUPS_FILE)))
+    else:
+        from .build import list_images
+        names = list_images(args.images)[0]
+        hash_path = args.hashes or os.path.join(os.path.dirname(os.path.abspath(args.images)), "dhash.npy")
+        sources = names
+    key = source_key(sources)
+    hashes = load_cached_hashes(hash_path, key)
+    if hashes is None and args.shards:
+        hashes = np.concatenate([hash_array(dataset.take(np.arange(i, min(i + 4096, len(dataset))))[0])
+                                 for i in range(0, len(dataset), 4096)])
+        save_cached_hashes(hash_path, key, hashes)
+    elif hashes is None:
+        hashes = hash_files(names, args.workers)
+        save_cached_hashes(hash_path, key, hashes)
+    hashed = time.perf_counter()
+
+    pairs = near_duplicate_pairs(hashes, args.radius)
+    groups = cluster(len(hashes), pairs)
+    summary = report(groups, names)
+    print("Hashed %d images in %.1fs, found %d pairs and %d clusters in %.2fs" % (
+        len(hashes), hashed - started, len(pairs), summary["clusters"], time.perf_counter() - hashed))
+    print("%d of %d images are near-duplicates of another image" % (summary["duplicate_images"], summary["images"]))
+    with open(args.report, "w") as file:
+        json.dump(summary, file, indent=1)
+    if args.shards:
+        np.save(os.path.join(args.shards, GROUPS_FILE), groups)
+
+
+if __name__ == "__main__":
+    main()
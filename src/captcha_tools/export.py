@@ -0,0 +1,121 @@
+"""
+Export trained .h5 models to int8 TFLite for CPU inference
+
+The converter quantizes weights and activations to int8 using a representative
+sample of image_data.npy and takes raw uint8 images as input (the models were
+trained on 0-255 pixels, so the input quantization is exact). TFLiteModel runs
+the exported file through tflite_runtime when it is installed, so scoring does
+not need to import the whole of TensorFlow
+"""
+import argparse
+import os
+
+import numpy as np
+
+
+def representative_images(image_path, samples=300, seed=0):
+    """
+    Generator over a random sample of images for the int8 calibration, one (1, 100, 100, 3) float32 batch each
+    """
+    images = np.load(image_path, mmap_mode="r")
+    indices = np.sort(np.random.default_rng(seed).choice(len(images), min(samples, len(images)), replace=False))
+
+    def generate():
+        for index in indices:
+            yield [np.asarray(images[index], dtype=np.float32)[None]]
+    return generate
+
+
+def export_tflite(model_path, output_path, image_path, samples=300):
+    """
+    Convert a keras model into a fully int8 quantized TFLite model with uint8 input and float32 output
+    Returns the size of the written file in bytes
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(tf.keras.models.load_model(model_path))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_images(image_path, samples)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    content = converter.convert()
+    with open(output_path, "wb") as file:
+        file.write(content)
+    return len(content)
+
+
+def _interpreter(model_path):
+    """
+    tflite_runtime's interpreter if it is installed, TensorFlow's otherwise
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=os.cpu_count())
+
+
+class TFLiteModel():
+    """
+    TFLite interpreter with the predict and output_shape of a keras model
+    """
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.interpreter = _interpreter(model_path)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    @property
+    def output_shape(self):
+        return (None,) + tuple(int(i) for i in self.output["shape"][1:])
+
+    def _quantize(self, batch):
+        """
+        Convert a batch to the input type, quantizing floats when the input is integer
+        """
+        dtype = self.input["dtype"]
+        scale, zero_point = self.input["quantization"]
+        if dtype == np.float32:
+            return np.asarray(batch, dtype=np.float32)
+        if scale in (0, 1) and zero_point == 0 and np.asarray(batch).dtype == dtype:
+            return np.asarray(batch)
+        info = np.iinfo(dtype)
+        return np.clip(np.round(np.asarray(batch, dtype=np.float32) / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        """
+        Run the whole batch through the interpreter at once, resizing the input when the batch size changes
+        """
+        batch = self._quantize(batch)
+        if len(batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input["index"], batch.shape)
+            self.interpreter.allocate_tensors()
+            self.input = self.interpreter.get_input_details()[0]
+            self.output = self.interpreter.get_output_details()[0]
+            self.batch_size = len(batch)
+        self.interpreter.set_tensor(self.input["index"], batch)
+        self.interpreter.invoke()
+        result = self.interpreter.get_tensor(self.output["index"])
+        scale, zero_point = self.output["quantization"]
+        if result.dtype != np.float32:
+            result = (result.astype(np.float32) - zero_point) * scale
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export .h5 models to int8 TFLite")
+    parser.add_argument("models", nargs="+", help=".h5 models to export, written next to them as .tflite")
+    parser.add_argument("--images", default="image_data.npy", help="image_data.npy to draw the representative dataset from")
+    parser.add_argument("--samples", type=int, default=300, help="representative images used for calibration")
+    args = parser.parse_args()
+
+    for model_path in args.models:
+        output_path = os.path.splitext(model_path)[0] + ".tflite"
+        size = export_tflite(model_path, output_path, args.images, args.samples)
+        print("%s -> %s (%.1f KiB, %.1f KiB as .h5)" % (model_path, output_path, size / 1024, os.path.getsize(model_path) / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Bounded LRU cache of decoded, pre-resized images with background prefetching
+
+Used by the labelling application so moving to the next/previous image is
+served from memory instead of decoding and resizing the jpeg on the Tk thread
+"""
+import threading
+from collections import OrderedDict, deque
+
+from PIL import Image
+
+from .profiling import timed
+
+
+class ImageCache():
+    """
+    Cache of path_format % index images resized to size
+    The least recently used image is evicted once capacity images are cached
+    """
+
+    def __init__(self, path_format, size=(400, 400), count=None, capacity=64, prefetch=8):
+        self.path_format = path_format
+        self.size = size
+        self.count = count
+        self.capacity = capacity
+        self.prefetch_count = prefetch
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._condition = threading.Condition(self._lock)
+        self._thread = threading.Thread(target=self._run, name="image-prefetch", daemon=True)
+        self._thread.start()
+
+    @timed("decode")
+    def _load(self, index):
+        with Image.open(self.path_format % index) as raw:
+            image = raw.resize(self.size)
+        image.load()
+        return image
+
+    def _put(self, index, image):
+        self._images[index] = image
+        self._images.move_to_end(index)
+        while len(self._images) > self.capacity:
+            self._images.popitem(last=False)
+
+    def get(self, index: int):
+        """
+        Returns the resized image, decoding it now if it is not cached yet
+        """
+        with self._lock:
+            image = self._images.get(index)
+            if image is not None:
+                self._images.move_to_end(index)
+                return image
+        image = self._load(index)
+        with self._lock:
+            self._put(index, image)
+        return image
+
+    def prefetch(self, index: int, direction=1):
+        """
+        Queue the next images after index in the navigation direction (1 or -1),
+        replacing whatever was still queued from an earlier position
+        """
+        indices = [index + direction * i for i in range(1, self.prefetch_count + 1)]
+        # One image the other way so turning around is cached too
+        indices.append(index - direction)
+        self.prefetch_indices(indices)
+
+    def prefetch_indices(self, indices):
+        """
+        Queue exactly these images, e.g. the next ones of the active-learning queue
+        """
+        with self._condition:
+            self._pending.clear()
+            for i in indices:
+                if i >= 0 and (self.count is None or i < self.count) and i not in self._images:
+                    self._pending.append(i)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                index = self._pending.popleft()
+                if index in self._images:
+                    continue
+            try:
+                image = self._load(index)
+            except OSError:
+                continue
+            with self._lock:
+                self._put(index, image)
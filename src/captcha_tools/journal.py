@@ -0,0 +1,150 @@
+"""
+Append-only journal of label updates for the labelling application
+
+Every submitted label is appended as a fixed-size binary record and fsynced in
+small batches, so saving costs O(1) and a crash loses at most the unsynced batch.
+A background thread periodically compacts the journal into labels.csv.
+On startup the journal is replayed on top of labels.csv
+"""
+import os
+import struct
+import threading
+
+from .profiling import stage
+
+# index (uint32), label bitmask (uint16), labelled flag (uint8)
+RECORD = struct.Struct("<IHB")
+
+
+class LabelJournal():
+    """
+    Journal of updates to a LabelStore that is compacted into csv_path
+    """
+
+    def __init__(self, path, store, csv_path, sync_every=8):
+        self.path = path
+        self.store = store
+        self.csv_path = csv_path
+        self.sync_every = sync_every
+        self._compacting_path = path + ".compacting"
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._unsynced = 0
+        # Records appended since the last compaction, idle intervals skip rewriting the csv
+        self._uncompacted = 0
+        self._stop = threading.Event()
+        self._thread = None
+        if os.path.exists(self.path) and os.path.getsize(self.path) % RECORD.size:
+            # Drop a record torn by a crash so new records stay aligned
+            os.truncate(self.path, os.path.getsize(self.path) // RECORD.size * RECORD.size)
+        self._file = open(self.path, "ab")
+
+    def replay(self):
+        """
+        Apply the journal (and a compaction interrupted by a crash) to the store
+        Returns the number of records applied
+        """
+        applied = 0
+        with self._lock:
+            for path in (self._compacting_path, self.path):
+                if not os.path.exists(path):
+                    continue
+                with open(path, "rb") as file:
+                    data = file.read()
+                usable = len(data) - len(data) % RECORD.size
+                for index, mask, labelled in RECORD.iter_unpack(data[:usable]):
+                    if labelled:
+                        self.store.set(index, [mask >> j & 1 for j in range(self.store.label_count)])
+                    else:
+                        self.store.clear(index)
+                    applied += 1
+            self._uncompacted += applied
+        return applied
+
+    def record(self, index: int, labels):
+        """
+        Update the store with labels (None to clear) and append it to the journal
+        """
+        with self._lock:
+            if labels is None:
+                self.store.clear(index)
+                self._file.write(RECORD.pack(index, 0, 0))
+            else:
+                self.store.set(index, labels)
+                self._file.write(RECORD.pack(index, int(self.store.masks[index]), 1))
+            self._unsynced += 1
+            self._uncompacted += 1
+            if self._unsynced >= self.sync_every:
+                self._sync()
+
+    def _sync(self):
+        if self._unsynced:
+            with stage("io/journal-sync"):
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def sync(self):
+        """
+        Force the pending records onto disk
+        """
+        with self._lock:
+            self._sync()
+
+    def compact(self):
+        """
+        Write the store into the csv and drop the journal records it now contains
+        The journal is rotated first so labelling can continue while the csv is written
+        """
+        with self._compact_lock:
+            self._compact()
+
+    def _compact(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+            if os.path.exists(self._compacting_path):
+                # A previous compaction did not finish, keep its records together
+                with open(self._compacting_path, "ab") as old, open(self.path, "rb") as new:
+                    old.write(new.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self._compacting_path)
+            self._file = open(self.path, "ab")
+            self._uncompacted = 0
+            snapshot = self.store.copy()
+        with stage("io/labels-csv"):
+            snapshot.to_csv(self.csv_path)
+        os.remove(self._compacting_path)
+
+    def start(self, sync_interval=2.0, compact_interval=120.0):
+        """
+        Start the background thread that syncs and compacts the journal
+        """
+        def run():
+            elapsed = 0.0
+            while not self._stop.wait(sync_interval):
+                elapsed += sync_interval
+                if elapsed >= compact_interval:
+                    elapsed = 0.0
+                    if self._uncompacted:
+                        self.compact()
+                    else:
+                        self.sync()
+                else:
+                    self.sync()
+        self._thread = threading.Thread(target=run, name="label-journal", daemon=True)
+        self._thread.start()
+
+    def close(self, compact=True):
+        """
+        Stop the background thread, optionally compact, and close the journal
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if compact and self._uncompacted:
+            self.compact()
+        with self._lock:
+            self._sync()
+            self._file.close()
@@ -0,0 +1,196 @@
+"""
+Packed storage for the multi-label vectors of labels.csv
+
+Every image has a uint16 bitmask (bit j set = label j present) and a bit in a
+separate "labelled" bitmap, so lookups and updates are O(1) and never scan
+the whole table. Import/export to the labels.csv format is lossless
+"""
+import csv
+import os
+
+import numpy as np
+
+MAX_LABELS = 16
+# Images per block of the unlabelled counts used to skip fully labelled regions
+BLOCK_SIZE = 512
+
+
+def _parse_row(row):
+    """
+    Parse a labels.csv row into (index, label list or None)
+    Also accepts rows where the whole line was quoted into a single field
+    """
+    if len(row) == 1 and "," in row[0]:
+        row = next(csv.reader([row[0]]))
+    index = int(row[0])
+    text = row[1].strip() if len(row) > 1 else ""
+    if not text or text.lower() == "nan":
+        return index, None
+    return index, [int(i) for i in text.strip("[]").split(",")]
+
+
+class LabelStore():
+    """
+    Label vectors of count images with label_count labels each
+    """
+
+    def __init__(self, count: int, label_count: int):
+        if label_count > MAX_LABELS:
+            raise ValueError("at most %d labels can be packed, got %d" % (MAX_LABELS, label_count))
+        self.count = count
+        self.label_count = label_count
+        self.masks = np.zeros(count, dtype=np.uint16)
+        self.labelled = np.zeros((count + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE // 8, dtype=np.uint8)
+        self._bits = 1 << np.arange(label_count, dtype=np.uint16)
+        # Number of unlabelled images in every block, kept up to date by set and clear
+        self.unlabelled_counts = np.full(len(self.labelled) * 8 // BLOCK_SIZE, BLOCK_SIZE, dtype=np.int32)
+        if count % BLOCK_SIZE:
+            self.unlabelled_counts[-1] = count % BLOCK_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def is_labelled(self, index: int) -> bool:
+        return bool(self.labelled[index >> 3] >> (index & 7) & 1)
+
+    def get(self, index: int):
+        """
+        Returns the label list of an image, or None if it is not labelled
+        """
+        if not self.is_labelled(index):
+            return None
+        mask = int(self.masks[index])
+        return [mask >> j & 1 for j in range(self.label_count)]
+
+    def set(self, index: int, labels):
+        """
+        Store the label list of an image and mark it as labelled
+        """
+        mask = 0
+        for j, value in enumerate(labels):
+            if value:
+                mask |= 1 << j
+        self.masks[index] = mask
+        if not self.is_labelled(index):
+            self.labelled[index >> 3] |= 1 << (index & 7)
+            self.unlabelled_counts[index // BLOCK_SIZE] -= 1
+
+    def clear(self, index: int):
+        """
+        Mark an image as unlabelled again
+        """
+        self.masks[index] = 0
+        if self.is_labelled(index):
+            self.labelled[index >> 3] &= ~np.uint8(1 << (index & 7))
+            self.unlabelled_counts[index // BLOCK_SIZE] += 1
+
+    def _block_unlabelled(self, block):
+        """
+        Sorted unlabelled indices inside a block
+        """
+        bits = np.unpackbits(self.labelled[block * BLOCK_SIZE // 8:(block + 1) * BLOCK_SIZE // 8], bitorder="little")
+        indices = np.flatnonzero(bits == 0) + block * BLOCK_SIZE
+        return indices[indices < self.count]
+
+    def unlabelled_total(self) -> int:
+        return int(self.unlabelled_counts.sum())
+
+    def rank_unlabelled(self, index: int) -> int:
+        """
+        Number of unlabelled images before index
+        """
+        index = min(max(index, 0), self.count)
+        block = index // BLOCK_SIZE
+        before = int(self.unlabelled_counts[:block].sum())
+        if block < len(self.unlabelled_counts):
+            before += int(np.count_nonzero(self._block_unlabelled(block) < index))
+        return before
+
+    def select_unlabelled(self, rank: int, amount: int):
+        """
+        Returns up to amount unlabelled indices, starting at the rank-th unlabelled image
+        """
+        if rank < 0 or rank >= self.unlabelled_total():
+            return np.zeros(0, dtype=np.int64)
+        totals = np.cumsum(self.unlabelled_counts)
+        block = int(np.searchsorted(totals, rank, side="right"))
+        offset = rank - (int(totals[block - 1]) if block else 0)
+        return self.next_unlabelled(int(self._block_unlabelled(block)[offset]), amount)
+
+    def next_unlabelled(self, start: int, amount: int):
+        """
+        Returns up to amount unlabelled indices >= start in ascending order
+        Blocks without unlabelled images are skipped through the block counts
+        """
+        start = max(start, 0)
+        found = []
+        needed = amount
+        first = start // BLOCK_SIZE
+        for block in first + np.flatnonzero(self.unlabelled_counts[first:]):
+            indices = self._block_unlabelled(block)
+            if block == first:
+                indices = indices[indices >= start]
+            found.append(indices[:needed])
+            needed -= len(found[-1])
+            if needed <= 0:
+                break
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    def copy(self):
+        """
+        Independent copy of the store
+        """
+        store = LabelStore(self.count, self.label_count)
+        store.masks[:] = self.masks
+        store.labelled[:] = self.labelled
+        store.unlabelled_counts[:] = self.unlabelled_counts
+        return store
+
+    def labelled_mask(self):
+        """
+        Boolean array of which images are labelled
+        """
+        return np.unpackbits(self.labelled, bitorder="little")[:self.count].astype(bool)
+
+    def matrix(self, indices=None):
+        """
+        Decode the bitmasks of indices (default all images) into an (n, label_count) uint8 matrix
+        """
+        masks = self.masks if indices is None else self.masks[indices]
+        return ((masks[:, None] & self._bits) != 0).astype(np.uint8)
+
+    @classmethod
+    def from_csv(cls, path, label_count: int, count=None):
+        """
+        Read a labels.csv file with an index column and a "[0, 1, ...]" label column
+        count is the minimum number of images, the store grows to fit every row in the file
+        """
+        rows = []
+        with open(path, "r", newline="") as file:
+            reader = csv.reader(file)
+            next(reader)
+            for row in reader:
+                if row:
+                    rows.append(_parse_row(row))
+        count = max(count or 0, max((i for i, _ in rows), default=-1) + 1)
+        store = cls(count, label_count)
+        for index, labels in rows:
+            if labels is not None:
+                store.set(index, labels)
+        return store
+
+    def to_csv(self, path):
+        """
+        Write the labels back into the labels.csv format
+        The file is written next to path first and moved over it, so a crash never leaves a partial csv
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["index", "label"])
+            for index in range(self.count):
+                labels = self.get(index)
+                writer.writerow([index, str(labels) if labels is not None else ""])
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
@@ -0,0 +1,391 @@
+"""
+Local stand-in for the reCAPTCHA image grid and an offline evaluation harness
+
+The server assembles 3x3 grids from labelled data/images tiles, so the ground
+truth of every tile is known. Like the dynamic reCAPTCHA grid, clicked tiles are
+replaced by new ones until the solver stops clicking and verifies. Every
+challenge and replacement is drawn from a seed, so runs are reproducible.
+
+The harness runs driverapp's click loop (solver.click_tiles) against it through
+MockDriver, an HTTP client with the click routine of browser.WebDriver, and
+reports the model latency per grid, the accuracy of the tile decisions, click
+precision/recall and the solve rate
+
+    python -m captcha_tools.mockcaptcha serve
+    python -m captcha_tools.mockcaptcha evaluate ../data/solver/multilabel_model.h5 --mode multi
+"""
+import argparse
+import io
+import json
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+from .compare import LABEL_NAMES, MODELS
+from .decision import model_thresholds
+from .labels import LabelStore
+from .score import load_model
+from .solver import click_tiles
+from .tiling import tile_grid
+
+GRID = 3
+# Chance that a replacement tile contains the target again
+REPLACEMENT_POSITIVE = 0.3
+
+
+class MockCaptcha():
+    """
+    Deterministic challenges over the labelled tiles, and the state of the ones being solved
+    """
+
+    def __init__(self, store, images_format, targets=None, seed=0):
+        self.images_format = images_format
+        self.seed = seed
+        labelled = np.flatnonzero(store.labelled_mask())
+        matrix = store.matrix(labelled).astype(bool)
+        self.targets = [LABEL_NAMES.index(i) for i in (targets or MODELS["multi"]["label_names"])]
+        # Tiles with and without every target label
+        self.positives = {i: labelled[matrix[:, i]] for i in self.targets}
+        self.negatives = {i: labelled[~matrix[:, i]] for i in self.targets}
+        self.targets = [i for i in self.targets if len(self.positives[i]) >= 6]
+        if not self.targets:
+            raise ValueError("no target label has enough labelled tiles")
+        self.challenges = {}
+        self.lock = threading.Lock()
+
+    def _draw(self, rng, label, positive):
+        pool = self.positives[label] if positive else self.negatives[label]
+        return int(pool[rng.integers(len(pool))])
+
+    def new(self, number: int):
+        """
+        Start (or restart) challenge number, returns its public description
+        """
+        rng = np.random.default_rng([self.seed, number])
+        label = self.targets[rng.integers(len(self.targets))]
+        positive = np.zeros(GRID * GRID, dtype=bool)
+        positive[rng.choice(GRID * GRID, rng.integers(2, 6), replace=False)] = True
+        tiles = [self._draw(rng, label, i) for i in positive]
+        with self.lock:
+            self.challenges[number] = {
+                "label": label, "tiles": tiles, "positive": positive.tolist(), "rng": rng,
+                "clicks": 0, "wrong_clicks": 0, "versions": [0] * (GRID * GRID),
+            }
+        return {"id": number, "label": LABEL_NAMES[label], "grid": "/challenge/%d/grid.jpeg" % number}
+
+    def grid(self, number: int):
+        """
+        JPEG of the current grid of challenge number
+        """
+        with self.lock:
+            tiles = list(self.challenges[number]["tiles"])
+        image = Image.new("RGB", (100 * GRID, 100 * GRID))
+        for position, index in enumerate(tiles):
+            with Image.open(self.images_format % index) as tile:
+                image.paste(tile.convert("RGB").resize((100, 100)), (100 * (position % GRID), 100 * (position // GRID)))
+        return _jpeg(image)
+
+    def tile(self, number: int, position: int):
+        """
+        JPEG of one tile of challenge number
+        """
+        _check_positions([position])
+        with self.lock:
+            index = self.challenges[number]["tiles"][position]
+        with Image.open(self.images_format % index) as tile:
+            return _jpeg(tile.convert("RGB").resize((100, 100)))
+
+    def click(self, number: int, positions):
+        """
+        Click tiles of challenge number and replace them, returns the urls of the new tiles
+        """
+        _check_positions(positions)
+        replaced = {}
+        with self.lock:
+            challenge = self.challenges[number]
+            for position in positions:
+                challenge["clicks"] += 1
+                challenge["wrong_clicks"] += not challenge["positive"][position]
+                positive = bool(challenge["rng"].random() < REPLACEMENT_POSITIVE)
+                challenge["tiles"][position] = self._draw(challenge["rng"], challenge["label"], positive)
+                challenge["positive"][position] = positive
+                challenge["versions"][position] += 1
+                replaced[position] = "/challenge/%d/tile/%d.jpeg?v=%d" % (number, position, challenge["versions"][position])
+        return {"replaced": replaced}
+
+    def verify(self, number: int):
+        """
+        Solved when no clicked tile was wrong and no target is left in the grid
+        """
+        with self.lock:
+            challenge = self.challenges.pop(number)
+        left = int(sum(challenge["positive"]))
+        return {
+            "success": challenge["wrong_clicks"] == 0 and left == 0,
+            "clicks": challenge["clicks"],
+            "wrong_clicks": challenge["wrong_clicks"],
+            "missed": left,
+        }
+
+    def truth(self, number: int):
+        """
+        Ground truth of the tiles currently shown, only used by the harness for its metrics
+        """
+        with self.lock:
+            return list(self.challenges[number]["positive"])
+
+
+def _check_positions(positions):
+    """
+    Raise ValueError unless positions is a list of tile positions of the grid
+    """
+    if not isinstance(positions, list) or not all(type(i) is int and 0 <= i < GRID * GRID for i in positions):
+        raise ValueError("tiles must be a list of positions between 0 and %d" % (GRID * GRID - 1))
+
+
+def _jpeg(image):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    GET /challenge/<id>, /challenge/<id>/grid.jpeg, /challenge/<id>/tile/<i>.jpeg, /challenge/<id>/truth
+    POST /challenge/<id>/click {"tiles": [...]}, /challenge/<id>/verify
+    Unknown challenges are answered with 404, malformed requests and tile positions with 400
+    """
+    ROUTES = [
+        ("GET", re.compile(r"^/challenge/(\d+)$"), lambda captcha, body, number: captcha.new(number)),
+        ("GET", re.compile(r"^/challenge/(\d+)/grid\.jpeg$"), lambda captcha, body, number: captcha.grid(number)),
+        ("GET", re.compile(r"^/challenge/(\d+)/tile/(\d+)\.jpeg$"), lambda captcha, body, number, position: captcha.tile(number, position)),
+        ("GET", re.compile(r"^/challenge/(\d+)/truth$"), lambda captcha, body, number: captcha.truth(number)),
+        ("POST", re.compile(r"^/challenge/(\d+)/click$"), lambda captcha, body, number: captcha.click(number, body.get("tiles"))),
+        ("POST", re.compile(r"^/challenge/(\d+)/verify$"), lambda captcha, body, number: captcha.verify(number)),
+    ]
+
+    def _handle(self, method):
+        path = self.path.split("?")[0]
+        for route_method, pattern, action in self.ROUTES:
+            match = pattern.match(path)
+            if route_method != method or not match:
+                continue
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length)) if length else {}
+                if not isinstance(body, dict):
+                    raise ValueError("the body must be a JSON object")
+                result = action(self.server.captcha, body, *[int(i) for i in match.groups()])
+            except KeyError:
+                # Unknown or already verified challenge
+                break
+            except ValueError as error:
+                self._send(400, json.dumps({"error": str(error)}).encode(), "application/json")
+                return
+            if isinstance(result, bytes):
+                self._send(200, result, "image/jpeg")
+            else:
+                self._send(200, json.dumps(result).encode(), "application/json")
+            return
+        self._send(404, b"{}", "application/json")
+
+    def _send(self, status, content, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(captcha, port=0):
+    """
+    Start the server on a background thread, returns it (server.server_address has the port)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.captcha = captcha
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        content = response.read()
+    return content if response.headers.get("Content-Type") == "image/jpeg" else json.loads(content)
+
+
+class MockDriver():
+    """
+    One challenge of the mock server behind the click routine of browser.WebDriver
+    Clicks are sent when the tiles are updated, so the ground truth of every round is read before the
+    clicked tiles are replaced, and the decision metrics of every round are collected on the way
+    """
+
+    def __init__(self, url, number):
+        self.url = url
+        self.number = number
+        challenge = _request("%s/challenge/%d" % (url, number))
+        self.label_name = challenge["label"]
+        self.images = tile_grid(io.BytesIO(_request(url + challenge["grid"])), GRID)
+        self._click_count = 0
+        self._clicked = []
+        self.correct = self.decisions = self.true_clicks = self.clicks = self.positives = 0
+
+    def set_click_count(self, count):
+        self._click_count = count
+
+    def get_click_count(self):
+        return self._click_count
+
+    def click_box(self, index):
+        self._click_count += 1
+        self._clicked.append(int(index))
+
+    def challenge_open(self):
+        """
+        Score the clicks of the round against the tiles shown, the mock challenge stays open until verified
+        """
+        truth = _request("%s/challenge/%d/truth" % (self.url, self.number))
+        clicked = set(self._clicked)
+        self.correct += sum((i in clicked) == truth[i] for i in range(len(truth)))
+        self.decisions += len(truth)
+        self.true_clicks += sum(truth[i] for i in clicked)
+        self.clicks += len(clicked)
+        self.positives += sum(truth)
+        return True
+
+    def wait_for_tiles(self):
+        pass
+
+    def update_image(self):
+        """
+        Send the clicks and download the tiles that replaced the clicked ones
+        """
+        replaced = _request("%s/challenge/%d/click" % (self.url, self.number), {"tiles": self._clicked})["replaced"]
+        for position, tile_url in replaced.items():
+            with Image.open(io.BytesIO(_request(self.url + tile_url))) as tile:
+                self.images[int(position)] = np.asarray(tile.convert("RGB"))
+        self._clicked = []
+
+    def get_images(self):
+        return self.images
+
+    def verify(self):
+        return _request("%s/challenge/%d/verify" % (self.url, self.number), {})
+
+
+class _TimedModel():
+    """
+    Model wrapper keeping the latency of every predict
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.latencies = []
+
+    def predict(self, batch, **kwargs):
+        started = time.perf_counter()
+        predictions = self.model.predict(batch, **kwargs)
+        self.latencies.append(time.perf_counter() - started)
+        return predictions
+
+
+def solve(url, number, model, label_names, thresholds, single_label, max_rounds=10):
+    """
+    Play one challenge with driverapp's click loop, returns its metrics
+    """
+    driver = MockDriver(url, number)
+    timed_model = _TimedModel(model)
+    predictions = timed_model.predict(driver.get_images(), verbose=0)
+    rounds = click_tiles(driver, timed_model, predictions, label_names.index(driver.label_name), thresholds,
+                         single_label, settle=0, max_rounds=max_rounds)
+    result = driver.verify()
+    result.update({
+        "label": driver.label_name,
+        "rounds": rounds,
+        "latency_ms": [i * 1000 for i in timed_model.latencies],
+        "decision_accuracy": driver.correct / driver.decisions,
+        "true_clicks": driver.true_clicks,
+        "clicks": driver.clicks,
+        "positives": driver.positives,
+    })
+    return result
+
+
+def evaluate(url, model, label_names, thresholds, single_label, grids=100, first=0):
+    """
+    Solve grids challenges and aggregate latency, decision accuracy, click precision/recall and solve rate
+    """
+    results = [solve(url, number, model, label_names, thresholds, single_label) for number in range(first, first + grids)]
+    latencies = np.concatenate([i["latency_ms"] for i in results])
+    clicks = sum(i["clicks"] for i in results)
+    positives = sum(i["positives"] for i in results)
+    true_clicks = sum(i["true_clicks"] for i in results)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "grids": grids,
+        "solve_rate": float(np.mean([i["success"] for i in results])),
+        "decision_accuracy": float(np.mean([i["decision_accuracy"] for i in results])),
+        "click_precision": true_clicks / clicks if clicks else 1.0,
+        "click_recall": true_clicks / positives if positives else 0.0,
+        "mean_rounds": float(np.mean([i["rounds"] for i in results])),
+        "latency_ms": {"p50": float(p50), "p95": float(p95), "p99": float(p99)},
+        "challenges": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock CAPTCHA grid server and offline solver evaluation")
+    parser.add_argument("--labels", default="../data/labels.csv")
+    parser.add_argument("--images", default="../data/images/%d.jpeg", help="image path format")
+    parser.add_argument("--seed", type=int, default=0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the mock server until interrupted")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    evaluate_parser = commands.add_parser("evaluate", help="solve challenges with a model and report the metrics")
+    evaluate_parser.add_argument("model", help=".h5 or .tflite model")
+    evaluate_parser.add_argument("--mode", choices=("multi", "single"), default="multi")
+    evaluate_parser.add_argument("--grids", type=int, default=100)
+    evaluate_parser.add_argument("--url", help="use a running server instead of starting one")
+    evaluate_parser.add_argument("--output", help="write the metrics as JSON")
+    args = parser.parse_args()
+
+    url = getattr(args, "url", None)
+    if url is None:
+        captcha = MockCaptcha(LabelStore.from_csv(args.labels, len(LABEL_NAMES)), args.images, seed=args.seed)
+        server = serve(captcha, getattr(args, "port", 0))
+        url = "http://127.0.0.1:%d" % server.server_address[1]
+    if args.command == "serve":
+        print("Serving mock CAPTCHA grids on %s" % url)
+        threading.Event().wait()
+
+    model = load_model(args.model)
+    config = MODELS[args.mode]
+    thresholds = model_thresholds(args.model, model.output_shape[-1], not config["single_label"])
+    result = evaluate(url, model, config["label_names"], thresholds, config["single_label"], args.grids)
+    print("%d grids: solved %.1f%%, decision accuracy %.3f, click precision %.3f recall %.3f, %.2f rounds per grid" % (
+        result["grids"], result["solve_rate"] * 100, result["decision_accuracy"], result["click_precision"],
+        result["click_recall"], result["mean_rounds"]))
+    print("model latency per grid: p50 %.2fms p95 %.2fms p99 %.2fms" % tuple(result["latency_ms"].values()))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
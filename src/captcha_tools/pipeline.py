@@ -0,0 +1,107 @@
+"""
+tf.data input pipeline for training on the on-disk dataset
+
+Rows are read a batch at a time through source.take() (a ShardedDataset or
+memory-mapped .npy arrays), so only the batches in flight are held in memory and
+datasets larger than RAM train fine. Augmentation (flip, brightness, contrast)
+runs on the fly in a parallel map instead of being baked into the files, and
+batches are prefetched so the training step never waits on the disk
+"""
+import numpy as np
+import tensorflow as tf
+
+from .shards import split_indices
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+class ArraySource():
+    """
+    take() over in-memory or memory-mapped image/label arrays, the interface of ShardedDataset
+    """
+
+    def __init__(self, images, labels):
+        if len(images) != len(labels):
+            raise ValueError("images and labels have different lengths (%d != %d)" % (len(images), len(labels)))
+        self.images = images
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.images)
+
+    def take(self, indices):
+        """
+        Gather the rows in indices, reading them in ascending order
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        order = np.argsort(indices, kind="stable")
+        images = np.empty((len(indices),) + self.images.shape[1:], dtype=self.images.dtype)
+        labels = np.empty((len(indices),) + self.labels.shape[1:], dtype=self.labels.dtype)
+        images[order] = self.images[indices[order]]
+        labels[order] = self.labels[indices[order]]
+        return images, labels
+
+    def split(self, test_size=0.2, seed=69, groups=None):
+        """
+        Shuffle the indices and split them into (train, test) index arrays like ShardedDataset.split
+        """
+        return split_indices(len(self), test_size, seed, groups)
+
+
+def augment_batch(images, generator, max_delta=25.0, contrast=(0.8, 1.2)):
+    """
+    Randomly flip every image of a float32 (n, height, width, 3) batch horizontally and
+    shift its brightness and contrast, each image with its own random values
+    """
+    count = tf.shape(images)[0]
+    flip = generator.uniform((count, 1, 1, 1)) < 0.5
+    images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    images = images + generator.uniform((count, 1, 1, 1), -max_delta, max_delta)
+    mean = tf.reduce_mean(images, axis=[1, 2, 3], keepdims=True)
+    images = (images - mean) * generator.uniform((count, 1, 1, 1), contrast[0], contrast[1]) + mean
+    return tf.clip_by_value(images, 0.0, 255.0)
+
+
+def training_dataset(source, indices, batch_size=32, training=False, augment=True, cache=None, shuffle_buffer=4096, seed=0):
+    """
+    Batched (images, labels) tf.data.Dataset over the rows of source in indices
+    training reshuffles every epoch and augments when augment is set, images come out as
+    float32 in 0-255 like the uint8 arrays Keras was fed before
+    cache keeps the decoded rows in memory ("") or in a cache file so later epochs skip the
+    disk reads, the rows are cached in one seeded random order and then shuffled through a
+    shuffle_buffer sized buffer every epoch
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if training and cache is not None:
+        # split() returns sorted indices and the single-label build is written class by class,
+        # the buffer alone would then fill almost every batch with one class
+        indices = np.random.default_rng(seed).permutation(indices)
+    sample_images, sample_labels = source.take(indices[:1])
+    dtypes = (tf.as_dtype(sample_images.dtype), tf.as_dtype(sample_labels.dtype))
+
+    def read(batch):
+        images, labels = tf.numpy_function(source.take, [batch], dtypes)
+        images.set_shape((None,) + sample_images.shape[1:])
+        labels.set_shape((None,) + sample_labels.shape[1:])
+        return images, labels
+
+    generator = tf.random.Generator.from_seed(seed)
+
+    def prepare(images, labels):
+        images = tf.cast(images, tf.float32)
+        if training and augment:
+            images = augment_batch(images, generator)
+        return images, labels
+
+    data = tf.data.Dataset.from_tensor_slices(indices)
+    if training and cache is None:
+        # Shuffling the indices is cheap and lets every batch be read straight from disk
+        data = data.shuffle(len(indices), seed=seed, reshuffle_each_iteration=True)
+    data = data.batch(batch_size).map(read, num_parallel_calls=AUTOTUNE, deterministic=not training)
+    if cache is not None:
+        data = data.unbatch().cache(cache)
+        if training:
+            data = data.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+        data = data.batch(batch_size)
+    data = data.map(prepare, num_parallel_calls=AUTOTUNE, deterministic=not training)
+    return data.prefetch(AUTOTUNE)
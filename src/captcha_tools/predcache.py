@@ -0,0 +1,154 @@
+"""
+Disk-backed cache of model predictions
+
+Predictions are keyed by (hash of the .h5 file, hash of the preprocessed image)
+in a sqlite database, looked up and stored a whole batch at a time. Only the
+misses are sent to the model. The cache keeps at most capacity predictions and
+evicts the least recently used ones, and predictions of an older version of a
+model file are dropped as soon as the changed file is opened
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from .profiling import stage
+
+_model_hashes = {}
+
+
+def model_hash(model_path):
+    """
+    sha256 of a model file, remembered while its size and mtime stay the same
+    """
+    stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _model_hashes:
+        digest = hashlib.sha256()
+        with open(model_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        _model_hashes[key] = digest.hexdigest()
+    return _model_hashes[key]
+
+
+def image_hashes(batch):
+    """
+    16-byte digest of every preprocessed image in a batch
+    """
+    batch = np.ascontiguousarray(batch)
+    return [hashlib.blake2b(image.tobytes(), digest_size=16).digest() for image in batch]
+
+
+class PredictionCache():
+    """
+    sqlite-backed LRU cache of predictions
+    """
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path, capacity=1000000):
+        self.path = path
+        self.capacity = capacity
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS predictions (
+                model TEXT NOT NULL,
+                image BLOB NOT NULL,
+                scores BLOB NOT NULL,
+                used REAL NOT NULL,
+                PRIMARY KEY (model, image)
+            );
+            CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used);
+            CREATE TABLE IF NOT EXISTS models (path TEXT PRIMARY KEY, hash TEXT NOT NULL);
+        """)
+
+    def model_key(self, model_path):
+        """
+        Hash of the model file, dropping the predictions of the previous file at this path
+        """
+        current = model_hash(model_path)
+        path = os.path.abspath(model_path)
+        row = self.connection.execute("SELECT hash FROM models WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != current:
+            with self.connection:
+                if row is not None:
+                    self.connection.execute("DELETE FROM predictions WHERE model = ?", (row[0],))
+                self.connection.execute("INSERT OR REPLACE INTO models (path, hash) VALUES (?, ?)", (path, current))
+        return current
+
+    def lookup(self, model_key, keys):
+        """
+        Cached scores of keys, a dict of image key -> float32 array
+        """
+        found = {}
+        for start in range(0, len(keys), self.LOOKUP_CHUNK):
+            chunk = keys[start:start + self.LOOKUP_CHUNK]
+            rows = self.connection.execute(
+                "SELECT image, scores FROM predictions WHERE model = ? AND image IN (%s)" % ",".join("?" * len(chunk)),
+                [model_key] + chunk
+            )
+            for image, scores in rows:
+                found[bytes(image)] = np.frombuffer(scores, dtype=np.float32)
+        if found:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE predictions SET used = ? WHERE model = ? AND image = ?",
+                    [(time.time(), model_key, i) for i in found]
+                )
+        return found
+
+    def store(self, model_key, keys, scores):
+        """
+        Save the scores of keys and evict the least recently used predictions over capacity
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO predictions (model, image, scores, used) VALUES (?, ?, ?, ?)",
+                [(model_key, key, np.asarray(row, dtype=np.float32).tobytes(), now) for key, row in zip(keys, scores)]
+            )
+            count = self.connection.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            if count > self.capacity:
+                self.connection.execute(
+                    "DELETE FROM predictions WHERE rowid IN (SELECT rowid FROM predictions ORDER BY used LIMIT ?)",
+                    (count - self.capacity,)
+                )
+
+    def predict(self, model, model_path, batch, **kwargs):
+        """
+        model.predict(batch) where only the images missing from the cache are predicted
+        """
+        model_key = self.model_key(model_path)
+        keys = image_hashes(batch)
+        with stage("io/prediction-cache"):
+            found = self.lookup(model_key, keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            predicted = np.asarray(model.predict(np.asarray(batch)[missing], **kwargs), dtype=np.float32)
+            with stage("io/prediction-cache"):
+                self.store(model_key, [keys[i] for i in missing], predicted)
+            found.update(zip((keys[i] for i in missing), predicted))
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0,) + model.output_shape[1:], dtype=np.float32)
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedModel():
+    """
+    Drop-in wrapper exposing predict and output_shape of a model backed by a PredictionCache
+    """
+
+    def __init__(self, model, model_path, cache):
+        self.model = model
+        self.model_path = model_path
+        self.cache = cache
+
+    @property
+    def output_shape(self):
+        return self.model.output_shape
+
+    def predict(self, batch, **kwargs):
+        return self.cache.predict(self.model, self.model_path, batch, **kwargs)
@@ -0,0 +1,247 @@
+"""
+Lightweight timing of the pipeline stages
+
+Wrap a stage in `with stage("predict"):` or decorate a function with
+@timed("decode"). Profiling is disabled by default, and then both cost a single
+flag check. When it is enabled, every stage keeps a log2 histogram of its wall
+times. Up to max_events individual spans are also kept for a Chrome trace, which
+can be opened in chrome://tracing or ui.perfetto.dev. Stage names are
+"category/detail", e.g. "io/journal-sync", and nested stages include the time
+of their children
+
+Set CAPTCHA_PROFILE=trace.json to profile a whole run of any of the apps or
+tools: the trace is written and the per-stage summary printed when it exits
+
+    python -m captcha_tools.profiling trace.json
+"""
+import argparse
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+ENVIRONMENT_VARIABLE = "CAPTCHA_PROFILE"
+# Bucket i holds the durations below 2 ** i nanoseconds, the last one everything longer (~9 minutes)
+BUCKETS = 40
+_DISABLED = contextlib.nullcontext()
+
+
+class Profiler():
+    """
+    Per-stage duration histograms and the recorded spans of one process
+    """
+
+    def __init__(self, max_events=1000000):
+        self.enabled = False
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.origin = time.perf_counter_ns()
+            # name -> [count, total nanoseconds, histogram]
+            self.stages = {}
+            self.events = []
+            self.threads = {}
+
+    def record(self, name, start, duration):
+        """
+        Add a span of duration nanoseconds that started at start (perf_counter_ns)
+        """
+        bucket = min(duration.bit_length(), BUCKETS - 1)
+        thread = threading.get_ident()
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = [0, 0, [0] * BUCKETS]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2][bucket] += 1
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, duration, thread))
+            if thread not in self.threads:
+                self.threads[thread] = threading.current_thread().name
+
+    def totals(self):
+        """
+        Total nanoseconds recorded so far by every stage, diff two calls to time a section
+        """
+        with self._lock:
+            return {name: stats[1] for name, stats in self.stages.items()}
+
+    def summary(self):
+        """
+        Count, total, mean, percentiles (over the recorded spans) and histogram of every stage
+        """
+        with self._lock:
+            stages = {name: (stats[0], stats[1], list(stats[2])) for name, stats in self.stages.items()}
+            durations = {}
+            for name, start, duration, thread in self.events:
+                durations.setdefault(name, []).append(duration)
+        result = {}
+        for name, (count, total, histogram) in sorted(stages.items()):
+            spans = sorted(durations.get(name, []))
+            result[name] = {
+                "count": count,
+                "total_ms": total / 1e6,
+                "mean_ms": total / count / 1e6,
+                "p50_ms": _percentile(spans, 50),
+                "p95_ms": _percentile(spans, 95),
+                "p99_ms": _percentile(spans, 99),
+                # Upper bound of the bucket in milliseconds -> count
+                "histogram": {"%.6g" % (2 ** i / 1e6): amount for i, amount in enumerate(histogram) if amount},
+            }
+        return result
+
+    def trace(self):
+        """
+        Chrome trace event format of the recorded spans, with the summary in otherData
+        """
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+            origin = self.origin
+        process = os.getpid()
+        trace_events = [{"name": "thread_name", "ph": "M", "pid": process, "tid": thread, "args": {"name": name}}
+                        for thread, name in threads.items()]
+        for name, start, duration, thread in events:
+            trace_events.append({
+                "name": name, "cat": name.split("/")[0], "ph": "X", "pid": process, "tid": thread,
+                "ts": (start - origin) / 1000, "dur": duration / 1000,
+            })
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms", "otherData": {"summary": self.summary()}}
+
+    def write_trace(self, path):
+        with open(path, "w") as file:
+            json.dump(self.trace(), file)
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] / 1e6
+
+
+class _Span():
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exception):
+        PROFILER.record(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+PROFILER = Profiler()
+
+
+def stage(name):
+    """
+    Context manager timing its body as name, a shared no-op while profiling is disabled
+    """
+    if not PROFILER.enabled:
+        return _DISABLED
+    return _Span(name)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of the function as name (its qualified name by default)
+    """
+    def decorate(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            with _Span(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def enable(trace_path=None):
+    """
+    Start profiling, with trace_path the trace is written and the summary printed at exit
+    """
+    PROFILER.enabled = True
+    if trace_path:
+        atexit.register(_finish, trace_path)
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+def _finish(trace_path):
+    PROFILER.write_trace(trace_path)
+    print_summary(PROFILER.summary(), sys.stderr)
+    print("Profile trace written to %s" % trace_path, file=sys.stderr)
+
+
+def print_summary(summary, file=sys.stdout):
+    """
+    One line per stage with its count, total, mean and percentiles
+    """
+    print("%-28s %8s %11s %10s %10s %10s %10s" % ("stage", "count", "total ms", "mean ms", "p50 ms", "p95 ms", "p99 ms"), file=file)
+    for name, stats in summary.items():
+        percentiles = ["%10s" % "-" if stats[i] is None else "%10.3f" % stats[i] for i in ("p50_ms", "p95_ms", "p99_ms")]
+        print("%-28s %8d %11.1f %10.3f %s" % (name, stats["count"], stats["total_ms"], stats["mean_ms"], " ".join(percentiles)), file=file)
+
+
+def print_histograms(summary, file=sys.stdout, width=40):
+    """
+    Text bar chart of the duration histogram of every stage
+    """
+    for name, stats in summary.items():
+        print(name, file=file)
+        largest = max(stats["histogram"].values())
+        for bound, amount in stats["histogram"].items():
+            print("  <%10s ms %8d %s" % (bound, amount, "#" * max(1, round(amount / largest * width))), file=file)
+
+
+def load_summary(trace_path):
+    """
+    Summary of a written trace, rebuilt from its spans
+    """
+    with open(trace_path, "r") as file:
+        trace = json.load(file)
+    profiler = Profiler(max_events=len(trace["traceEvents"]))
+    for event in trace["traceEvents"]:
+        if event.get("ph") == "X":
+            profiler.record(event["name"], int(event["ts"] * 1000), int(event["dur"] * 1000))
+    return profiler.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a profile trace written with %s=trace.json" % ENVIRONMENT_VARIABLE)
+    parser.add_argument("trace")
+    parser.add_argument("--histograms", action="store_true", help="also print the duration histogram of every stage")
+    parser.add_argument("--output", help="write the summary as JSON")
+    args = parser.parse_args()
+
+    summary = load_summary(args.trace)
+    print_summary(summary)
+    if args.histograms:
+        print_histograms(summary)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent=1)
+
+
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    enable(os.environ[ENVIRONMENT_VARIABLE])
+
+if __name__ == "__main__":
+    main()
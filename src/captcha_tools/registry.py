@@ -0,0 +1,100 @@
+"""
+Process-wide registry of the loaded models
+
+Every model file is loaded once per process, and again only when the file
+changes. Keras models are wrapped in a tf.function with a fixed
+(None, 100, 100, 3) float32 signature, so the graph is traced once for all batch
+sizes instead of on the first predict of each one. Every model is warmed up
+on blank batches when it is loaded, so the first timed predict already runs at
+steady-state speed. driverapp.py, score.load_model and through it every offline
+tool and the mock CAPTCHA harness share the registry
+"""
+import os
+import threading
+
+import numpy as np
+
+from .build import IMAGE_SHAPE
+from .export import TFLiteModel
+from .profiling import stage
+
+# Batch sizes run once after loading: a single tile and a whole 3x3 grid
+WARM_UP_BATCH_SIZES = (1, 9)
+# Same default as keras Model.predict
+DEFAULT_BATCH_SIZE = 32
+
+_models = {}
+_lock = threading.Lock()
+
+
+class CompiledModel():
+    """
+    Keras model with a predict traced once for (None, 100, 100, 3) batches
+    """
+
+    def __init__(self, model):
+        import tensorflow as tf
+        self.model = model
+        self._predict = tf.function(
+            lambda batch: model(batch, training=False),
+            input_signature=[tf.TensorSpec((None,) + IMAGE_SHAPE, tf.float32)],
+        )
+
+    @property
+    def output_shape(self):
+        return self.model.output_shape
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        """
+        Drop-in for keras Model.predict, run batch_size images per call
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        outputs = [self._predict(batch[i:i + batch_size]).numpy() for i in range(0, len(batch), batch_size)]
+        if not outputs:
+            return np.zeros((0,) + tuple(self.output_shape[1:]), dtype=np.float32)
+        return np.concatenate(outputs)
+
+
+def warm_up(model, batch_sizes=WARM_UP_BATCH_SIZES):
+    """
+    Predict blank batches so tracing and buffer allocation happen before anything is timed
+    """
+    with stage("warm-up"):
+        for batch_size in batch_sizes:
+            model.predict(np.zeros((batch_size,) + IMAGE_SHAPE, dtype=np.uint8), batch_size=batch_size, verbose=0)
+
+
+def _load(model_path, cpu):
+    if model_path.endswith(".tflite"):
+        return TFLiteModel(model_path)
+    import tensorflow as tf
+    if cpu:
+        tf.config.set_visible_devices([], "GPU")
+    return CompiledModel(tf.keras.models.load_model(model_path))
+
+
+def get_model(model_path, cpu=True):
+    """
+    The loaded and warmed up model of model_path, a .h5 or .tflite file
+    cpu hides the GPUs from TensorFlow, it only has an effect on the first load of the process
+    """
+    key = os.path.abspath(model_path)
+    modified = os.stat(model_path).st_mtime_ns
+    with _lock:
+        entry = _models.get(key)
+        if entry is not None and entry[0] == modified:
+            return entry[1]
+        with stage("io/load-model"):
+            model = _load(model_path, cpu)
+        warm_up(model)
+        _models[key] = (modified, model)
+        return model
+
+
+def clear():
+    """
+    Forget every loaded model
+    """
+    with _lock:
+        _models.clear()
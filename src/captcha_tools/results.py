@@ -0,0 +1,242 @@
+"""
+Append-only log of the CAPTCHA solving attempts
+
+Every attempt of driverapp.py is one fixed-width NumPy record appended to
+data/multiresult/results.rec: when it finished, the model and mode, the label it
+was solved on, the verify count (0 when it failed) and the time spent in each
+pipeline stage. Appending never rewrites earlier records, and the whole log is
+read back as a structured array (memory-mapped) for the aggregation and plots
+
+The file starts with a fixed-size header holding the record layout as JSON. A
+record cut short by a crash is ignored when the log is read
+
+    python -m captcha_tools.results summary
+    python -m captcha_tools.results plot
+    python -m captcha_tools.results import ../data/multiresult/multiresult.csv --mode multi
+"""
+import argparse
+import ast
+import json
+import os
+import time
+
+import numpy as np
+
+MAGIC = b"CAPTCHA-RESULTS\n"
+HEADER_SIZE = 1024
+# Result column -> profiling stage whose time it holds
+STAGE_COLUMNS = {
+    "download_ms": "io/download",
+    "tiling_ms": "tiling",
+    "decode_ms": "decode",
+    "predict_ms": "predict",
+    "decision_ms": "decision",
+    "wait_ms": "wait/tiles",
+}
+RESULT_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    # Start time of the run the attempt belongs to, the same for every attempt of one Application
+    ("run", "<f8"),
+    ("model", "S48"),
+    ("mode", "S8"),
+    ("label", "S16"),
+    ("verify_count", "i1"),
+    ("attempt_ms", "<f4"),
+] + [(name, "<f4") for name in STAGE_COLUMNS])
+MODE_TITLES = {"multi": "MULTI LABEL", "single": "SINGLE LABEL"}
+RESULTS_PATH = "../data/multiresult/results.rec"
+
+
+def _header(dtype):
+    layout = json.dumps(dtype.descr).encode()
+    if len(MAGIC) + len(layout) + 1 > HEADER_SIZE:
+        raise ValueError("record layout does not fit into the header")
+    return (MAGIC + layout + b"\n").ljust(HEADER_SIZE, b" ")
+
+
+def _read_dtype(file):
+    header = file.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ValueError("%s is not a results log" % file.name)
+    return np.dtype([tuple(field) for field in json.loads(header[len(MAGIC):].split(b"\n")[0])])
+
+
+class ResultLog():
+    """
+    Appends attempts to a results log, creating it when needed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as file:
+                file.write(_header(RESULT_DTYPE))
+        else:
+            with open(path, "rb") as file:
+                if _read_dtype(file) != RESULT_DTYPE:
+                    raise ValueError("%s was written with a different record layout" % path)
+        self._file = open(path, "ab")
+        # A crash may have left a partial record, appending after it would shift every later one
+        end = os.path.getsize(path)
+        complete = HEADER_SIZE + (end - HEADER_SIZE) // RESULT_DTYPE.itemsize * RESULT_DTYPE.itemsize
+        if complete != end:
+            self._file.truncate(complete)
+
+    def append(self, model, mode, label, verify_count, attempt_ms=np.nan, stages=None, run=np.nan, timestamp=None):
+        """
+        Write one attempt, stages maps the STAGE_COLUMNS stage names to milliseconds
+        """
+        record = np.zeros(1, dtype=RESULT_DTYPE)
+        record["timestamp"] = time.time() if timestamp is None else timestamp
+        record["run"] = run
+        record["model"] = os.path.basename(model).encode()[:48]
+        record["mode"] = mode.encode()
+        record["label"] = str(label).encode()[:16]
+        record["verify_count"] = verify_count
+        record["attempt_ms"] = attempt_ms
+        for column, name in STAGE_COLUMNS.items():
+            record[column] = (stages or {}).get(name, np.nan)
+        self._file.write(record.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def read_results(path):
+    """
+    Every complete record of a results log as a read-only structured array
+    """
+    with open(path, "rb") as file:
+        dtype = _read_dtype(file)
+    count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+def import_legacy(csv_path, log, model, mode):
+    """
+    Append the attempts of an old str(list) result.csv dump, returns how many were imported
+    """
+    with open(csv_path, "r") as file:
+        counts, labels = ast.literal_eval(file.read())
+    run = os.path.getmtime(csv_path)
+    for count, label in zip(counts, labels):
+        log.append(model, mode, label, count, run=run, timestamp=run)
+    return len(counts)
+
+
+def summarize(results):
+    """
+    Per mode and model: attempts, success rate, mean verify count of the solved ones,
+    solves per label and mean stage times
+    """
+    summary = {}
+    keys = np.unique(results[["mode", "model"]]) if len(results) else []
+    for mode, model in keys:
+        rows = results[(results["mode"] == mode) & (results["model"] == model)]
+        solved = rows["verify_count"] > 0
+        labels, counts = np.unique(rows["label"][solved], return_counts=True)
+        summary["%s %s" % (mode.decode(), model.decode())] = {
+            "attempts": int(len(rows)),
+            "runs": int(len(np.unique(rows["run"][~np.isnan(rows["run"])]))),
+            "success_rate": float(solved.mean()),
+            "mean_verify_count": float(rows["verify_count"][solved].mean()) if solved.any() else None,
+            "solved_labels": {label.decode(): int(count) for label, count in zip(labels, counts)},
+            "mean_ms": {column: _nanmean(rows[column]) for column in ["attempt_ms"] + list(STAGE_COLUMNS)},
+        }
+    return summary
+
+
+def _nanmean(values):
+    values = np.asarray(values, dtype=np.float64)
+    return float(np.nanmean(values)) if np.isfinite(values).any() else None
+
+
+def plot(results, output_directory):
+    """
+    Write the verify-count chart of every mode (multilabel.png, singlelabel.png) and the
+    success-rate comparison.png, the latest model of every mode is used. Returns the written paths
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    written = []
+    rates = []
+    for mode, title in MODE_TITLES.items():
+        rows = results[results["mode"] == mode.encode()]
+        if len(rows) == 0:
+            continue
+        rows = rows[rows["model"] == rows["model"][np.argmax(rows["timestamp"])]]
+        X = np.arange(1, len(rows) + 1)
+        figure = plt.figure()
+        plt.bar(X, rows["verify_count"])
+        plt.xlabel("Attempt")
+        plt.ylabel("Verify Count")
+        plt.ylim(0, 5)
+        plt.title("%s RESULT" % title)
+        path = os.path.join(output_directory, "%slabel.png" % mode)
+        figure.savefig(path)
+        plt.close(figure)
+        written.append(path)
+        rates.append((title.title(), (rows["verify_count"] > 0).mean() * 100))
+    if rates:
+        figure = plt.figure()
+        bars = plt.bar([i[0] for i in rates], [i[1] for i in rates])
+        for bar, (name, rate) in zip(bars, rates):
+            plt.text(bar.get_x() + bar.get_width() / 2, rate / 2, "%.0f%%" % rate, ha="center")
+        plt.ylabel("Success Rate")
+        plt.ylim(0, 100)
+        plt.title("COMPARISON GRAPH")
+        path = os.path.join(output_directory, "comparison.png")
+        figure.savefig(path)
+        plt.close(figure)
+        written.append(path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate and plot the CAPTCHA solving results log")
+    parser.add_argument("--results", default=RESULTS_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_parser = commands.add_parser("summary", help="print success rates and stage times per model")
+    summary_parser.add_argument("--output", help="also write the summary as JSON")
+    plot_parser = commands.add_parser("plot", help="regenerate the result charts without a display")
+    plot_parser.add_argument("--output-directory", default="../data/multiresult")
+    import_parser = commands.add_parser("import", help="append an old str(list) result.csv dump")
+    import_parser.add_argument("csv")
+    import_parser.add_argument("--mode", choices=tuple(MODE_TITLES), required=True)
+    import_parser.add_argument("--model", help="model file name, defaults to the mode's solver model")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        log = ResultLog(args.results)
+        model = args.model or ("multilabel_model.h5" if args.mode == "multi" else "singlelabel_model.h5")
+        print("Imported %d attempts" % import_legacy(args.csv, log, model, args.mode))
+        log.close()
+        return
+    started = time.perf_counter()
+    results = read_results(args.results)
+    if args.command == "plot":
+        for path in plot(results, args.output_directory):
+            print("Wrote %s" % path)
+        return
+    summary = summarize(results)
+    for name, stats in summary.items():
+        print("%s: %d attempts over %d runs, %.1f%% solved, %s verifies per solve" % (
+            name, stats["attempts"], stats["runs"], stats["success_rate"] * 100,
+            "-" if stats["mean_verify_count"] is None else "%.2f" % stats["mean_verify_count"]))
+        timings = ", ".join("%s %.0fms" % (column[:-3], value) for column, value in stats["mean_ms"].items() if value is not None)
+        if timings:
+            print("  mean per attempt: %s" % timings)
+    print("Aggregated %d attempts in %.1fms" % (len(results), (time.perf_counter() - started) * 1000))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
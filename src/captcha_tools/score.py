@@ -0,0 +1,171 @@
+"""
+Offline batched scoring of data/images with a trained .h5 model
+
+A reader thread decodes images into large batches through a bounded queue while
+the model predicts on the CPU. Probabilities are written into a memory-mapped
+(N, classes) float32 .npy and progress is recorded next to it, so an interrupted
+run resumes where it stopped
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from .build import IMAGE_SHAPE, list_images, process_image
+from .predcache import CachedModel, PredictionCache, model_hash
+from .profiling import stage
+from .registry import get_model
+
+
+def model_output_path(model_path, suffix):
+    """
+    File for cached outputs next to a model, e.g. multilabel_model_calibration.npy
+    (multilabel_model_tflite_calibration.npy for the exported .tflite)
+    """
+    base, extension = os.path.splitext(model_path)
+    if extension not in ("", ".h5"):
+        base += "_" + extension[1:]
+    return base + suffix
+
+
+def load_model(model_path, cpu=True, cache_path=None):
+    """
+    The keras (hiding the GPUs first when cpu is set) or .tflite model from the registry,
+    loaded once per process and warmed up
+    With cache_path the model is wrapped so repeated images come from the prediction cache
+    """
+    model = get_model(model_path, cpu)
+    if cache_path:
+        return CachedModel(model, model_path, PredictionCache(cache_path))
+    return model
+
+
+def _put(batches, item, stop):
+    """
+    Put item on the batches queue unless stop is set while waiting, returns whether it was put
+    """
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def read_batches(paths, start, batch_size, batches, stop):
+    """
+    Decode paths[start:] into (offset, batch) items on the batches queue, None marks the end
+    A decoding error is put on the queue instead so the scoring loop can raise it
+    Every put gives up once stop is set, so the reader never blocks after the scoring loop is gone
+    """
+    for offset in range(start, len(paths), batch_size):
+        chunk = paths[offset:offset + batch_size]
+        batch = np.empty((len(chunk),) + IMAGE_SHAPE, dtype=np.uint8)
+        try:
+            with stage("decode"):
+                for i, path in enumerate(chunk):
+                    with Image.open(path) as raw:
+                        batch[i] = process_image(raw)
+        except OSError as error:
+            _put(batches, error, stop)
+            return
+        if not _put(batches, (offset, batch), stop):
+            return
+    _put(batches, None, stop)
+
+
+def paths_hash(paths):
+    """
+    sha256 of an ordered list of image paths
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode() + b"\0")
+    return digest.hexdigest()
+
+
+def score_images(model, paths, output_path, batch_size=512, queue_size=4, report_every=10.0, model_path=None):
+    """
+    Score every image in paths with model into output_path
+    A previous run is only resumed when it scored the same paths with the same model file
+    Returns the memory-mapped score array
+    """
+    progress_path = output_path + ".progress.json"
+    classes = model.output_shape[-1]
+    key = {
+        "count": len(paths),
+        "model": model_hash(model_path) if model_path is not None else None,
+        "paths": paths_hash(paths),
+    }
+    start = 0
+    if os.path.exists(output_path) and os.path.exists(progress_path):
+        with open(progress_path, "r") as file:
+            progress = json.load(file)
+        scores = np.load(output_path, mmap_mode="r+")
+        if all(progress.get(name) == value for name, value in key.items()) and scores.shape == (len(paths), classes):
+            start = progress["completed"]
+            print("Resuming at image %d of %d" % (start, len(paths)))
+        else:
+            # Scores of another model or another image list, start over
+            del scores
+    if start == 0:
+        scores = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=(len(paths), classes))
+
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    reader = threading.Thread(target=read_batches, args=(paths, start, batch_size, batches, stop), daemon=True)
+    reader.start()
+    scored = 0
+    started = last_report = time.perf_counter()
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            offset, batch = item
+            with stage("predict"):
+                scores[offset:offset + len(batch)] = model.predict(batch, batch_size=len(batch), verbose=0)
+            with stage("io/scores"):
+                scores.flush()
+                with open(progress_path, "w") as file:
+                    json.dump(dict(key, completed=offset + len(batch)), file)
+            scored += len(batch)
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                print("%d/%d images, %.1f images/sec" % (offset + len(batch), len(paths), scored / (now - started)))
+                last_report = now
+    finally:
+        stop.set()
+        reader.join()
+    elapsed = time.perf_counter() - started
+    if scored:
+        print("Scored %d images in %.1fs, %.1f images/sec" % (scored, elapsed, scored / elapsed))
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score data/images with a trained model")
+    parser.add_argument("model", help="path to the .h5 or .tflite model")
+    parser.add_argument("--images", default="../data/images")
+    parser.add_argument("--output", default="../data/scores.npy", help="memory-mapped (N, classes) output")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--queue-size", type=int, default=4, help="decoded batches allowed to wait for the model")
+    parser.add_argument("--prediction-cache", help="sqlite prediction cache shared between runs")
+    args = parser.parse_args()
+
+    paths = list_images(args.images)[0]
+    score_images(load_model(args.model, cache_path=args.prediction_cache), paths, args.output, args.batch_size, args.queue_size,
+                 model_path=args.model)
+
+
+if __name__ == "__main__":
+    main()
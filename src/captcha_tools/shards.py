@@ -0,0 +1,196 @@
+"""
+Sharded on-disk dataset format
+
+A dataset directory holds fixed-size image/label .npy shards and an index.json
+with the label counts, the offset of every shard and a content hash.
+Shards are memory-mapped on first access, so opening a dataset is close to
+instant and train/test splits are plain index arrays instead of copies
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .dedup import group_split
+
+INDEX_FILE = "index.json"
+GROUPS_FILE = "groups.npy"
+
+
+def _shard_hash(directory, shard, chunk_size=1 << 20):
+    """
+    sha256 over the image and label files of a shard
+    """
+    digest = hashlib.sha256()
+    for name in (shard["images"], shard["labels"]):
+        with open(os.path.join(directory, name), "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def split_indices(count: int, test_size=0.2, seed=69, groups=None):
+    """
+    Shuffle range(count) and split it into sorted (train, test) index arrays
+    With groups every near-duplicate cluster is kept on one side of the split
+    """
+    if groups is not None:
+        return group_split(groups, test_size, seed)
+    order = np.random.default_rng(seed).permutation(count)
+    test_count = int(round(count * test_size))
+    return np.sort(order[test_count:]), np.sort(order[:test_count])
+
+
+def write_shards(images, labels, directory, shard_size=4096, label_names=None):
+    """
+    Split images and labels into shards of shard_size rows inside directory
+    images and labels can be memory-mapped, only one shard is held in memory at a time
+    Returns the written index
+    """
+    if len(images) != len(labels):
+        raise ValueError("images and labels have different lengths (%d != %d)" % (len(images), len(labels)))
+    os.makedirs(directory, exist_ok=True)
+    shards = []
+    dataset_hash = hashlib.sha256()
+    label_counts = np.zeros(labels.shape[1:], dtype=np.int64)
+    for number, offset in enumerate(range(0, len(images), shard_size)):
+        image_file = "images-%05d.npy" % number
+        label_file = "labels-%05d.npy" % number
+        shard_labels = np.asarray(labels[offset:offset + shard_size])
+        np.save(os.path.join(directory, image_file), np.asarray(images[offset:offset + shard_size]))
+        np.save(os.path.join(directory, label_file), shard_labels)
+        label_counts += (shard_labels > 0).sum(axis=0)
+        shard = {"images": image_file, "labels": label_file, "offset": offset, "count": len(shard_labels)}
+        shard["hash"] = _shard_hash(directory, shard)
+        dataset_hash.update(shard["hash"].encode())
+        shards.append(shard)
+
+    index = {
+        "count": len(images),
+        "shard_size": shard_size,
+        "image_shape": list(images.shape[1:]),
+        "image_dtype": str(images.dtype),
+        "label_shape": list(labels.shape[1:]),
+        "label_dtype": str(labels.dtype),
+        "label_names": list(label_names) if label_names is not None else None,
+        "label_counts": label_counts.tolist(),
+        "shards": shards,
+        "hash": dataset_hash.hexdigest()
+    }
+    with open(os.path.join(directory, INDEX_FILE), "w") as file:
+        json.dump(index, file, indent=1)
+    return index
+
+
+class ShardedDataset():
+    """
+    Read-only, memory-mapped view over a sharded dataset directory
+    dataset[i] returns a zero-copy (image, label) pair
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE), "r") as file:
+            self.index = json.load(file)
+        self.shards = self.index["shards"]
+        self.offsets = np.array([i["offset"] for i in self.shards] + [self.index["count"]], dtype=np.int64)
+        self._images = [None] * len(self.shards)
+        self._labels = [None] * len(self.shards)
+
+    def __len__(self):
+        return self.index["count"]
+
+    @property
+    def label_names(self):
+        return self.index["label_names"]
+
+    @property
+    def label_counts(self):
+        return np.array(self.index["label_counts"])
+
+    def _shard(self, number):
+        """
+        Memory-map a shard the first time it is accessed
+        """
+        if self._images[number] is None:
+            shard = self.shards[number]
+            self._images[number] = np.load(os.path.join(self.directory, shard["images"]), mmap_mode="r")
+            self._labels[number] = np.load(os.path.join(self.directory, shard["labels"]), mmap_mode="r")
+        return self._images[number], self._labels[number]
+
+    def _locate(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("index %d out of range for dataset of size %d" % (index, len(self)))
+        number = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return number, index - self.offsets[number]
+
+    def __getitem__(self, index):
+        number, position = self._locate(int(index))
+        images, labels = self._shard(number)
+        return images[position], labels[position]
+
+    def take(self, indices):
+        """
+        Gather the rows in indices into a contiguous (images, labels) batch
+        Rows are read shard by shard, the batch keeps the order of indices
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        images = np.empty((len(indices),) + tuple(self.index["image_shape"]), dtype=self.index["image_dtype"])
+        labels = np.empty((len(indices),) + tuple(self.index["label_shape"]), dtype=self.index["label_dtype"])
+        numbers = np.searchsorted(self.offsets, indices, side="right") - 1
+        for number in np.unique(numbers):
+            selected = np.flatnonzero(numbers == number)
+            shard_images, shard_labels = self._shard(number)
+            positions = indices[selected] - self.offsets[number]
+            images[selected] = shard_images[positions]
+            labels[selected] = shard_labels[positions]
+        return images, labels
+
+    @property
+    def groups(self):
+        """
+        Near-duplicate cluster of every row from groups.npy (see captcha_tools.dedup), None without it
+        """
+        path = os.path.join(self.directory, GROUPS_FILE)
+        if not os.path.exists(path):
+            return None
+        groups = np.load(path)
+        return groups if len(groups) == len(self) else None
+
+    def split(self, test_size=0.2, seed=69, groups=None):
+        """
+        Shuffle the dataset indices and split them into (train, test) index arrays
+        With groups every near-duplicate cluster is kept on one side of the split
+        """
+        return split_indices(len(self), test_size, seed, groups)
+
+    def verify(self):
+        """
+        Recompute the content hash of every shard
+        Returns the list of shard files that do not match the index
+        """
+        mismatched = []
+        for shard in self.shards:
+            if _shard_hash(self.directory, shard) != shard["hash"]:
+                mismatched.append(shard["images"])
+        return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert image_data.npy/label_data.npy into a sharded dataset")
+    parser.add_argument("images", help="path to image_data.npy")
+    parser.add_argument("labels", help="path to label_data.npy")
+    parser.add_argument("output", help="dataset directory to write")
+    parser.add_argument("--shard-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    index = write_shards(np.load(args.images, mmap_mode="r"), np.load(args.labels, mmap_mode="r"), args.output, args.shard_size)
+    print("%d images in %d shards, hash %s" % (index["count"], len(index["shards"]), index["hash"]))
+
+
+if __name__ == "__main__":
+    main()
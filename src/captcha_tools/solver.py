@@ -0,0 +1,40 @@
+"""
+Click loop of a dynamic CAPTCHA grid, shared by driverapp.py and the mock CAPTCHA harness
+
+driver is anything with the click routine of browser.WebDriver: set_click_count,
+click_box, get_click_count, challenge_open, wait_for_tiles, update_image and
+get_images. Clicked tiles are replaced by new images, which are predicted again
+until no tile is clicked anymore
+"""
+from time import sleep
+
+from .decision import tiles_to_click
+from .profiling import stage
+
+
+def click_tiles(driver, model, predictions, label: int, thresholds, single_label=False, settle=8, max_rounds=None):
+    """
+    Click the tiles predicted to contain label, then predict the replaced tiles and click
+    again until nothing is clicked, the challenge closes or max_rounds rounds were played
+    settle is how long to wait in seconds for the replaced tiles to fade in
+    Returns the number of rounds
+    """
+    rounds = 0
+    while True:
+        rounds += 1
+        driver.set_click_count(0)
+        with stage("decision"):
+            clicks = tiles_to_click(predictions, label, thresholds, single_label)
+        for i in clicks:
+            driver.click_box(i)
+        if not driver.challenge_open():
+            return rounds
+        if driver.get_click_count() == 0 or rounds == max_rounds:
+            return rounds
+        with stage("wait/tiles"):
+            sleep(settle)
+            driver.wait_for_tiles()
+        driver.set_click_count(0)
+        driver.update_image()
+        with stage("predict"):
+            predictions = model.predict(driver.get_images())
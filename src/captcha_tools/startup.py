@@ -0,0 +1,95 @@
+"""
+Startup benchmark of the labelling app, driverapp.py and the offline tools
+
+Every target runs in a fresh interpreter with -X importtime, and the wall time
+until it is ready is measured (imported, --help printed, or the first labelling
+window drawn when a display is available). The heaviest top-level imports of
+every target are listed, which is where a slow startup comes from
+
+Run it from src/: python -m captcha_tools.startup
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+SRC_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIRECTORY = os.path.dirname(SRC_DIRECTORY)
+FIRST_WINDOW = "import labelling_app; app = labelling_app.Application(); app.update(); app.journal.close(compact=False)"
+# (name, working directory, interpreter arguments)
+TARGETS = [
+    ("labelling_app import", SRC_DIRECTORY, ["-c", "import labelling_app"]),
+    ("labelling_app first window", SRC_DIRECTORY, ["-c", FIRST_WINDOW]),
+    ("driverapp import", ROOT_DIRECTORY, ["-c", "import driverapp"]),
+    ("score --help", SRC_DIRECTORY, ["-m", "captcha_tools.score", "--help"]),
+    ("calibrate --help", SRC_DIRECTORY, ["-m", "captcha_tools.calibrate", "--help"]),
+    ("compare --help", SRC_DIRECTORY, ["-m", "captcha_tools.compare", "--help"]),
+    ("export --help", SRC_DIRECTORY, ["-m", "captcha_tools.export", "--help"]),
+]
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def heaviest_imports(importtime, count=5, expand=("labelling_app", "driverapp")):
+    """
+    The count top-level imports with the largest cumulative time, as (module, milliseconds)
+    The imports of the modules in expand are listed instead of the modules themselves
+    """
+    imports = []
+    parent = None
+    # importtime lists the imports of a module before the module itself
+    for line in reversed(importtime.splitlines()):
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        depth = len(match.group(3))
+        if depth == 1:
+            parent = match.group(4)
+        if (depth == 1 and parent not in expand) or (depth == 3 and parent in expand):
+            imports.append((match.group(4), int(match.group(2)) / 1000))
+    return sorted(imports, key=lambda i: -i[1])[:count]
+
+
+def measure(directory, arguments, repeat=5):
+    """
+    Median wall time in seconds of a fresh interpreter running arguments, with the
+    importtime output of the last run, or None when the target fails
+    """
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime"] + arguments, cwd=directory,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        timings.append(time.perf_counter() - started)
+        if process.returncode != 0:
+            return None, process.stderr
+    return sorted(timings)[len(timings) // 2], process.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the apps and tools")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, directory, arguments in TARGETS:
+        if arguments[-1] == FIRST_WINDOW and not os.environ.get("DISPLAY") and sys.platform.startswith("linux"):
+            print("%-28s skipped (no display)" % name)
+            continue
+        seconds, importtime = measure(directory, arguments, args.repeat)
+        if seconds is None:
+            print("%-28s failed: %s" % (name, importtime.strip().splitlines()[-1]))
+            continue
+        heaviest = heaviest_imports(importtime)
+        results[name] = {"seconds": seconds, "heaviest_imports": heaviest}
+        print("%-28s %7.1fms  %s" % (name, seconds * 1000, ", ".join("%s %.0fms" % i for i in heaviest)))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Split a CAPTCHA grid image into its tiles in one vectorized pass
+
+The grid is decoded once, resized once as a whole when its tiles are not
+100x100 already, and cut into tiles through a reshape/transpose view of the
+pixel array (no per-tile crops, resizes or np.concatenate). The tiles are
+written into a single contiguous (grid * grid, 100, 100, 3) array
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from .profiling import stage, timed
+
+TILE_SIZE = (100, 100)
+
+
+def to_rgb(image):
+    """
+    Decode a path, file object or PIL image into an RGB PIL image
+    """
+    if not isinstance(image, Image.Image):
+        with stage("decode"), Image.open(image) as raw:
+            return raw.convert("RGB")
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def grid_view(pixels, grid=3):
+    """
+    View of the pixels as (grid, grid, tile height, tile width, 3) without copying
+    Trailing pixels that do not fill a whole tile are dropped like the old crop loop did
+    """
+    tile_height = pixels.shape[0] // grid
+    tile_width = pixels.shape[1] // grid
+    cropped = pixels[:tile_height * grid, :tile_width * grid]
+    return cropped.reshape(grid, tile_height, grid, tile_width, -1).transpose(0, 2, 1, 3, 4)
+
+
+def resize_grid(image, grid=3, size=TILE_SIZE):
+    """
+    Pixels of an RGB PIL image cropped to whole tiles and resized in one Pillow call so every
+    tile becomes size. The crop happens inside the resize (box), so the image is never copied
+    A grid whose tiles already have that size (a 300px 3x3 grid) is not resampled at all
+    Only the pixels along the tile seams can differ slightly from resizing every tile on its own
+    """
+    tile_width = image.width // grid
+    tile_height = image.height // grid
+    if (tile_width, tile_height) == size:
+        return np.asarray(image)
+    return np.asarray(image.resize((size[0] * grid, size[1] * grid), box=(0, 0, tile_width * grid, tile_height * grid)))
+
+
+@timed("tiling")
+def tile_grid(image, grid=3, size=TILE_SIZE):
+    """
+    Split a grid image into a contiguous (grid * grid, height, width, 3) uint8 array of
+    resized tiles, ordered row by row like the CAPTCHA table cells
+    """
+    tiles = np.array(grid_view(resize_grid(to_rgb(image), grid, size), grid), dtype=np.uint8)
+    return tiles.reshape((grid * grid,) + tiles.shape[2:])
+
+
+def _tile_grid_loop(image, grid=3, size=TILE_SIZE):
+    """
+    The previous per-tile PIL crop/resize/np.concatenate loop, kept for the benchmark
+    """
+    width, height = image.size
+    grid_width = width // grid
+    grid_height = height // grid
+    cropped_images = np.zeros((0, size[1], size[0], 3), dtype=np.uint8)
+    for i in range(grid):
+        for j in range(grid):
+            cropped = image.crop((j * grid_width, i * grid_height, (j + 1) * grid_width, (i + 1) * grid_height))
+            if cropped.mode == "RGBA":
+                cropped = cropped.convert("RGB")
+            cropped_images = np.concatenate((cropped_images, [np.array(cropped.resize(size))]))
+    return cropped_images
+
+
+def benchmark(grid_size=300, grid=3, repeat=200):
+    """
+    Time the per-tile loop against tile_grid on a random grid image
+    Returns (loop seconds, vectorized seconds, largest pixel difference, mean pixel difference)
+    """
+    pixels = np.random.default_rng(0).integers(0, 256, (grid_size, grid_size, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    started = time.perf_counter()
+    for i in range(repeat):
+        expected = _tile_grid_loop(image, grid)
+    loop_time = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for i in range(repeat):
+        tiles = tile_grid(image, grid)
+    vectorized_time = (time.perf_counter() - started) / repeat
+    difference = np.abs(tiles.astype(int) - expected)
+    return loop_time, vectorized_time, int(difference.max()), float(difference.mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grid tiling")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for grid_size, grid in ((300, 3), (450, 4)):
+        loop_time, vectorized_time, largest, mean = benchmark(grid_size, grid, args.repeat)
+        print("%dx%d grid of %dpx: loop %.3fms, vectorized %.3fms (%.1fx), pixel difference max %d mean %.3f" % (
+            grid, grid, grid_size, loop_time * 1000, vectorized_time * 1000, loop_time / vectorized_time, largest, mean))
+
+
+if __name__ == "__main__":
+    main()
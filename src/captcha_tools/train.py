@@ -0,0 +1,294 @@
+"""
+Scriptable training of the CNN architectures from the notebooks
+
+A run directory keeps the last and the best model, the training state and a CSV
+log with the duration and samples/sec of every epoch. Running the same command
+again resumes from the last completed epoch, including the early stopping
+patience, so long CPU runs can be restarted after a crash or a reboot
+"""
+import argparse
+import csv
+import json
+import os
+import time
+
+import tensorflow as tf
+from tensorflow.keras import layers
+
+from .pipeline import training_dataset
+from .shards import ShardedDataset
+
+INPUT_SHAPE = (100, 100, 3)
+
+
+def _paper1():
+    return [
+        layers.Conv2D(32, (3, 3), activation='relu', input_shape=INPUT_SHAPE),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D((3, 3)),
+        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.MaxPooling2D((3, 3)),
+        layers.Flatten(),
+        layers.Dense(64, activation='relu'),
+    ]
+
+
+def _paper2():
+    return [
+        layers.Conv2D(32, (3, 3), activation='relu', input_shape=INPUT_SHAPE),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D((3, 3)),
+        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(64, activation='relu'),
+    ]
+
+
+def _paper3():
+    return _paper2() + [layers.Dropout(0.1)]
+
+
+def _paper4():
+    return [
+        layers.Conv2D(32, (3, 3), activation='relu', input_shape=INPUT_SHAPE),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D((3, 3)),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(64, activation='relu'),
+        layers.Dropout(0.1),
+    ]
+
+
+def _paper5():
+    return [
+        layers.Conv2D(32, (3, 3), activation='relu', input_shape=INPUT_SHAPE),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D((3, 3)),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(128, activation='relu'),
+        layers.Dense(64, activation='relu'),
+        layers.Dropout(0.1),
+    ]
+
+
+def _paper6():
+    return [
+        layers.Conv2D(32, (3, 3), activation='relu', input_shape=INPUT_SHAPE),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(64, activation='relu'),
+        layers.Dropout(0.1),
+    ]
+
+
+def _manual():
+    return [
+        layers.Conv2D(64, (3, 3), activation="relu", input_shape=INPUT_SHAPE),
+        layers.Conv2D(64, (3, 3), activation="relu"),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(128, (3, 3), activation="relu"),
+        layers.Conv2D(128, (3, 3), activation="relu"),
+        layers.MaxPooling2D((3, 3), strides=(2, 2)),
+        layers.Dropout(0.25),
+        layers.Conv2D(256, (3, 3), activation="relu"),
+        layers.Conv2D(256, (3, 3), activation="relu"),
+        layers.GlobalAveragePooling2D(),
+        layers.BatchNormalization(),
+        layers.Flatten(),
+        layers.Dense(128, activation="relu"),
+        layers.Dropout(0.25),
+    ]
+
+
+def _blocks():
+    return [
+        # Block 1
+        layers.Conv2D(16, (3, 3), activation='relu', input_shape=INPUT_SHAPE),
+        layers.Conv2D(32, (3, 3), activation='relu'),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        # Block 2
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        # Block 3
+        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(128, activation='relu'),
+        layers.Dropout(rate=0.35),
+    ]
+
+
+def _efficientnet():
+    return [
+        tf.keras.applications.EfficientNetB0(weights="imagenet", include_top=False, input_shape=INPUT_SHAPE),
+        layers.MaxPooling2D((2, 2)),
+        layers.Dropout(0.2),
+        layers.BatchNormalization(),
+        layers.Flatten(),
+    ]
+
+
+# Every architecture without its output layer, named after the notebook cells they come from
+ARCHITECTURES = {
+    "paper1": _paper1,
+    "paper2": _paper2,
+    "paper3": _paper3,
+    "paper4": _paper4,
+    "paper5": _paper5,
+    "paper6": _paper6,
+    "manual": _manual,
+    "blocks": _blocks,
+    "efficientnet": _efficientnet,
+}
+
+
+def build_model(name, classes=12, multi_label=False):
+    """
+    Compiled Sequential model of a named architecture
+    Multi-label models get a sigmoid output trained with binary crossentropy instead of softmax
+    """
+    if name not in ARCHITECTURES:
+        raise ValueError("unknown architecture %s, choose from %s" % (name, ", ".join(ARCHITECTURES)))
+    output = layers.Dense(classes, activation="sigmoid" if multi_label else "softmax")
+    model = tf.keras.models.Sequential(ARCHITECTURES[name]() + [output], name=name)
+    if multi_label:
+        model.compile(optimizer="adam", loss=tf.keras.losses.BinaryCrossentropy(), metrics=["binary_accuracy"])
+    else:
+        model.compile(optimizer="adam", loss=tf.keras.losses.CategoricalCrossentropy(), metrics=["accuracy"])
+    return model
+
+
+class ResumableEarlyStopping(tf.keras.callbacks.EarlyStopping):
+    """
+    EarlyStopping that starts from the best value and patience counter of an earlier run
+    """
+
+    def __init__(self, best=None, wait=0, **kwargs):
+        super().__init__(**kwargs)
+        self.resume_best = best
+        self.resume_wait = wait
+
+    def on_train_begin(self, logs=None):
+        super().on_train_begin(logs)
+        if self.resume_best is not None:
+            self.best = self.resume_best
+            self.wait = self.resume_wait
+
+
+class EpochLog(tf.keras.callbacks.Callback):
+    """
+    Append the duration, samples/sec and metrics of every epoch to a CSV log and save the
+    resume state after the epoch's checkpoint has been written
+    """
+
+    def __init__(self, log_path, state_path, samples, early_stopping):
+        super().__init__()
+        self.log_path = log_path
+        self.state_path = state_path
+        self.samples = samples
+        self.early_stopping = early_stopping
+        self.started = 0.0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.started = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self.started
+        row = {"epoch": epoch + 1, "seconds": round(seconds, 3), "samples_per_sec": round(self.samples / seconds, 1)}
+        row.update({key: float(value) for key, value in (logs or {}).items()})
+        new_file = not os.path.exists(self.log_path)
+        with open(self.log_path, "a", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(row))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+        state = {"epoch": epoch + 1, "best": float(self.early_stopping.best), "wait": self.early_stopping.wait}
+        with open(self.state_path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(self.state_path + ".tmp", self.state_path)
+        print("epoch %d: %.1fs, %.1f samples/sec" % (epoch + 1, seconds, self.samples / seconds))
+
+
+def train(name, data_dir, run_dir, epochs=20, batch_size=32, patience=5, multi_label=False, test_size=0.2, cache=None):
+    """
+    Train a named architecture on a sharded dataset, resuming the run in run_dir if there is one
+    Returns the model with the lowest val_loss
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    last_path = os.path.join(run_dir, "last.h5")
+    best_path = os.path.join(run_dir, "best.h5")
+    state_path = os.path.join(run_dir, "state.json")
+
+    dataset = ShardedDataset(data_dir)
+    # Near-duplicates stay on one side of the split when dedup has written groups.npy
+    train_index, test_index = dataset.split(test_size=test_size, seed=69, groups=dataset.groups)
+    train_data = training_dataset(dataset, train_index, batch_size, training=True, cache=cache)
+    test_data = training_dataset(dataset, test_index, batch_size)
+
+    state = {"epoch": 0, "best": None, "wait": 0}
+    if os.path.exists(last_path) and os.path.exists(state_path):
+        with open(state_path, "r") as file:
+            state = json.load(file)
+        model = tf.keras.models.load_model(last_path)
+        print("Resuming %s after epoch %d" % (name, state["epoch"]))
+    else:
+        model = build_model(name, len(dataset.label_counts), multi_label)
+
+    early_stopping = ResumableEarlyStopping(
+        best=state["best"], wait=state["wait"], monitor="val_loss", patience=patience, restore_best_weights=True)
+    callbacks = [
+        tf.keras.callbacks.ModelCheckpoint(last_path),
+        tf.keras.callbacks.ModelCheckpoint(best_path, monitor="val_loss", save_best_only=True,
+                                           initial_value_threshold=state["best"]),
+        early_stopping,
+        EpochLog(os.path.join(run_dir, "train_log.csv"), state_path, len(train_index), early_stopping),
+    ]
+    if state["epoch"] < epochs and state["wait"] < patience:
+        model.fit(train_data, epochs=epochs, initial_epoch=state["epoch"], validation_data=test_data, callbacks=callbacks)
+    else:
+        print("%s already finished after epoch %d" % (name, state["epoch"]))
+    # best.h5 also covers improvements made before the last resume
+    return tf.keras.models.load_model(best_path) if os.path.exists(best_path) else model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a named CNN architecture with checkpoints and resume")
+    parser.add_argument("architecture", choices=sorted(ARCHITECTURES))
+    parser.add_argument("--data", default="../data/shards", help="sharded dataset directory")
+    parser.add_argument("--run", help="run directory, defaults to ../data/runs/<architecture>")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--patience", type=int, default=5, help="epochs without val_loss improvement before stopping")
+    parser.add_argument("--multi-label", action="store_true", help="sigmoid output with binary crossentropy")
+    parser.add_argument("--cache", help="cache decoded rows in this file (\"\" for memory)")
+    args = parser.parse_args()
+
+    run_dir = args.run or os.path.join("../data/runs", args.architecture)
+    model = train(args.architecture, args.data, run_dir, args.epochs, args.batch_size, args.patience, args.multi_label, cache=args.cache)
+    model.save(os.path.join(run_dir, "%s.h5" % args.architecture))
+
+
+if __name__ == "__main__":
+    main()
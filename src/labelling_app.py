@@ -1,13 +1,89 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
-from PIL import ImageTk, Image
-import pandas as pd
+import os
+from PIL import ImageTk
+from captcha_tools.labels import LabelStore
+from captcha_tools.journal import LabelJournal
+from captcha_tools.imagecache import ImageCache
+from captcha_tools.activequeue import LabelQueue
+
+class VirtualList(tk.Frame):
+    """
+    Scrollable list over any number of rows that only ever owns a fixed pool of row widgets
+    Scrolling rebinds the text and command of the pooled rows instead of creating widgets
+    changed() is called after every scroll
+    """
+    def __init__(self, parent, visible_rows, command, changed=None):
+        tk.Frame.__init__(self, parent)
+        self.command = command
+        self.changed = changed
+        self.rows = lambda first, amount: []
+        self.total = 0
+        self.first = 0
+
+        rows_frame = tk.Frame(self)
+        rows_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.pool = []
+        for i in range(visible_rows):
+            frame = tk.Frame(rows_frame, highlightbackground="black", highlightthickness=1)
+            text = tk.Label(frame)
+            button = tk.Button(frame, text="Open/Label")
+            frame.pack(fill=tk.X, pady=2)
+            text.pack(side=tk.LEFT)
+            button.pack(side=tk.RIGHT, pady=5, padx=10)
+            self.pool.append((text, button))
+
+    def set_rows(self, total, rows, first=0):
+        """
+        Set the row source
+        total: amount of rows, rows(first, amount): list of (index, text) for the visible rows
+        """
+        self.total = total
+        self.rows = rows
+        self.scroll_to(first)
+
+    def scroll_to(self, first):
+        """
+        Show the rows starting at first
+        """
+        self.first = max(min(first, self.total - len(self.pool)), 0)
+        items = self.rows(self.first, len(self.pool))
+        for position, (text, button) in enumerate(self.pool):
+            if position < len(items):
+                index, string = items[position]
+                text.configure(text=string)
+                button.configure(state="normal", command=lambda index=index: self.command(index))
+            else:
+                text.configure(text="")
+                button.configure(state="disabled", command="")
+        if self.total:
+            self.scrollbar.set(self.first / self.total, (self.first + len(self.pool)) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+        if self.changed is not None:
+            self.changed()
+
+    def on_scroll(self, action, amount, unit=None):
+        """
+        Scrollbar command, handles dragging (moveto) and the arrows/trough (scroll)
+        """
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.total))
+        elif unit == "pages":
+            self.scroll_to(self.first + int(amount) * len(self.pool))
+        else:
+            self.scroll_to(self.first + int(amount))
+
 
 class MainMenuPage(tk.Frame):
     """
     Main page that displays all the images names and its current state
     """
+    VISIBLE_ROWS = 12
+
     def __init__(self, controller):
         tk.Frame.__init__(self)
         self.controller = controller
@@ -27,21 +103,15 @@ class MainMenuPage(tk.Frame):
         self.query_entry.pack(side=tk.LEFT, padx=5)
         self.query_button.pack(side=tk.RIGHT, padx=5)
 
-        # Canvas Creation
-        self.canvas = tk.Canvas(controller)
-        self.canvas.pack(fill=tk.BOTH, expand=True)
-
-        # Scroll Bar implementation
-        self.scrollbar = ttk.Scrollbar(self.canvas, orient=tk.VERTICAL, command=self.canvas.yview)
-        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-        self.canvas.bind_all("<MouseWheel>", self.on_mousewheel)
-        self.current_frame = None
-        self.current_index = 0
+        # Virtualized list of every image, the rows are reused while scrolling
+        self.image_list = VirtualList(controller, self.VISIBLE_ROWS, self.open_label_page, self.set_page_buttons)
+        self.image_list.pack(fill=tk.BOTH, expand=True, padx=(20, 0))
+        self.image_list.bind_all("<MouseWheel>", self.on_mousewheel)
+        self.labelled_shown = False
         bottom_frame = tk.Frame(self)
         self.next_page_button = tk.Button(bottom_frame, text="Next Page", command=self.next_page)
         self.prev_page_button = tk.Button(bottom_frame, text="Prev Page", command=self.prev_page)
-        self.middle_button = tk.Button(self, text="Show Labelled", command=lambda: self.create_labels(True), width=15, height=2)
+        self.middle_button = tk.Button(self, text="Show Labelled", command=self.toggle_labelled, width=15, height=2)
         self.create_labels()
 
         
@@ -63,27 +133,50 @@ class MainMenuPage(tk.Frame):
 
     def prev_page(self):
         """
-        Go to the previous 100 images
+        Scroll up by 100 images
         """
-        self.current_index -= 100
-        self.display_current()
+        self.image_list.scroll_to(self.image_list.first - 100)
 
     def next_page(self):
         """
-        Go to the next 100 images
+        Scroll down by 100 images
         """
-        self.current_index += 100
-        self.display_current()
+        self.image_list.scroll_to(self.image_list.first + 100)
 
-    def display_current(self):
+    def set_page_buttons(self):
         """
-        Displays the list of images according to current settings
-        with labelled shown or not
+        Check if there are next pages or not and set the button states
         """
-        if self.middle_button.cget("text") == "Show Labelled":
-            self.create_labels()
+        if self.image_list.first == 0:
+            self.prev_page_button.configure(state="disabled")
         else:
-            self.create_labels(True)
+            self.prev_page_button.configure(state="normal")
+        if self.image_list.first + self.VISIBLE_ROWS >= self.image_list.total:
+            self.next_page_button.configure(state="disabled")
+        else:
+            self.next_page_button.configure(state="normal")
+
+    def first_shown(self):
+        """
+        Image index of the top row of the list
+        """
+        if self.labelled_shown:
+            return self.image_list.first
+        first = self.controller.label_data.select_unlabelled(self.image_list.first, 1)
+        return int(first[0]) if len(first) else self.controller.IMAGE_COUNT
+
+    def toggle_labelled(self):
+        """
+        Show or hide the labelled images, keeping the list at the image on top
+        """
+        self.create_labels(not self.labelled_shown, self.first_shown())
+
+    def display_current(self, index=0):
+        """
+        Displays the list of images according to current settings
+        with labelled shown or not, starting from image index
+        """
+        self.create_labels(self.labelled_shown, index)
 
     def validate_search(self, value):
         """
@@ -113,8 +206,7 @@ class MainMenuPage(tk.Frame):
         """
         Change the list to start from the index in the query entry
         """
-        self.current_index = int(self.query_value.get())
-        self.display_current()
+        self.display_current(int(self.query_value.get()))
 
     def submit_search(self):
         """
@@ -129,56 +221,38 @@ class MainMenuPage(tk.Frame):
         if not isinstance(event.widget, tk.Entry):
             self.controller.focus()
 
-    def create_labels(self, labelled=False):
+    def create_labels(self, labelled=False, index=0):
         """
-        Create the list of images on the main page
+        Point the list of images on the main page at all images (labelled=True)
+        or only at the unlabelled ones, scrolled to image index
         """
-        # Check if there are next pages or not and set the button states
-        if self.current_index < 99:
-            self.prev_page_button.configure(state="disabled")
-        else:
-            self.prev_page_button.configure(state="normal")
-        if self.current_index > (54107 - 99):
-            self.next_page_button.configure(state="disabled")
-        else:
-            self.next_page_button.configure(state="normal")
-
-        image_indices = []
-        display_names = []
-        current_index = self.current_index
+        label_data = self.controller.label_data
+        self.labelled_shown = labelled
         if labelled:
-            self.middle_button.configure(text="Hide Labelled", command=lambda: self.create_labels(False))
-            while len(image_indices) < 100 and current_index < 54107:
-                string = "%d.jpeg" % current_index
-                if self.controller.check_if_labelled(current_index) == True:
-                    string += " (labelled)"
-                display_names.append(string)
-                image_indices.append(current_index)
-                current_index += 1
+            self.middle_button.configure(text="Hide Labelled")
+            self.image_list.set_rows(self.controller.IMAGE_COUNT, self.all_rows, index)
         else:
-            self.middle_button.configure(text="Show Labelled", command=lambda: self.create_labels(True))
-            while len(image_indices) < 100 and current_index < 54107:
-                if self.controller.check_if_labelled(current_index) == False:
-                    image_indices.append(current_index)
-                    display_names.append("%d.jpeg" % current_index)
-                current_index += 1
-        indices = {k: v for (k, v) in zip(display_names, image_indices)} # type: ignore
-        # Destroy previous list if there are any
-        if self.current_frame:
-            self.current_frame.destroy()
-
-        # Create the frame list inside the canvas
-        self.current_frame = tk.Frame(self.canvas)
-        self.canvas.create_window((0, 0), window=self.current_frame, anchor=tk.NW, width=770)
-        for i in display_names:
-            frame = tk.Frame(self.current_frame, highlightbackground="black", highlightthickness=1)
-            text = tk.Label(frame, text=i)
-            button = tk.Button(frame, text="Open/Label", command=lambda index=indices[i]: self.open_label_page(index))
-            frame.pack(fill=tk.X, pady=2)
-            text.pack(side=tk.LEFT)
-            button.pack(side=tk.RIGHT, pady=5, padx=10)
-        self.canvas.update_idletasks()
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+            self.middle_button.configure(text="Show Labelled")
+            # Row n of the list is the n-th unlabelled image, found through the label index
+            self.image_list.set_rows(label_data.unlabelled_total(), self.unlabelled_rows, label_data.rank_unlabelled(index))
+
+    def all_rows(self, first, amount):
+        """
+        Rows of the list when labelled images are shown
+        """
+        rows = []
+        for i in range(first, min(first + amount, self.controller.IMAGE_COUNT)):
+            string = "%d.jpeg" % i
+            if self.controller.check_if_labelled(i) == True:
+                string += " (labelled)"
+            rows.append((i, string))
+        return rows
+
+    def unlabelled_rows(self, first, amount):
+        """
+        Rows of the list when labelled images are hidden
+        """
+        return [(int(i), "%d.jpeg" % i) for i in self.controller.label_data.select_unlabelled(first, amount)]
 
     def open_label_page(self, index: int):
         """
@@ -186,21 +260,26 @@ class MainMenuPage(tk.Frame):
         """
         print("INDEX %d CLICKED" % index)
         self.controller.to_label = index
-        self.canvas.destroy()
+        self.image_list.unbind_all("<MouseWheel>")
+        self.image_list.destroy()
         self.heading.destroy()
-        self.scrollbar.destroy()
         self.controller.show_page(LabellingPage)
 
     def on_mousewheel(self, event):
         """
         Function to implement mouse wheel control
         """
-        self.canvas.yview_scroll(-1 * int(event.delta/120), "units")
+        self.image_list.scroll_to(self.image_list.first - 3 * int(event.delta/120))
 
 class LabellingPage(tk.Frame):
     """
     Page that is displayed to label the data
+    The page is built once and reused, update_index swaps the image and the switch states
     """
+    # Keys that toggle the switches in order, Right/Return = next, Left = previous, Escape = return
+    SHORTCUT_KEYS = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "0", "minus"]
+    SHORTCUT_TEXT = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "0", "-"]
+
     def __init__(self, controller):
         tk.Frame.__init__(self)
         self.pack(fill=tk.BOTH, padx=(20, 20))
@@ -208,25 +287,21 @@ class LabellingPage(tk.Frame):
         self.index = controller.to_label
 
         heading = tk.Frame(self, pady=20)
-        heading_text = tk.Label(heading, text="%d.jpeg" % controller.to_label, font=("Arial", 18))
+        self.heading_text = tk.Label(heading, font=("Arial", 18))
         back_button = tk.Button(heading, text="Return", command=lambda: controller.show_page(MainMenuPage))
         heading.pack(fill=tk.X)
-        heading_text.pack()
+        self.heading_text.pack()
         back_button.place(in_=heading, anchor="nw")
 
         # Create Frame to display Image
         image_frame = tk.Frame(self, highlightbackground="black", highlightthickness=1)
         image_frame.pack()
-        raw_image = Image.open("../data/images/%d.jpeg" % controller.to_label)
-        raw_image = raw_image.resize((400, 400))
-        # plt.imshow(np.array(raw_image))
-        # plt.show()
-        self.current_img = ImageTk.PhotoImage(raw_image)
-        image_label = tk.Label(image_frame, image=self.current_img)
-        image_label.pack(pady=10, padx= 10)
+        self.current_img = None
+        self.image_label = tk.Label(image_frame)
+        self.image_label.pack(pady=10, padx= 10)
 
         # Create switches and buttons
-        self.intvar = [tk.IntVar(value=i) for i in self.initialize_labels()]
+        self.intvar = [tk.IntVar(value=0) for i in controller.label_names]
         self.create_switches()
         # submit_button = tk.Button(self, width=30, height=3, text="Submit and Continue", font=("Arial", 14), command=self.submit, borderwidth=2)
         # submit_button.pack(pady=20)
@@ -236,40 +311,74 @@ class LabellingPage(tk.Frame):
         self.prev_button = tk.Button(bottom_frame, text="Prev Image", width=15, height=3, command=lambda: self.submit(False))
         self.next_button.pack(side=tk.RIGHT)
         self.prev_button.pack(side=tk.LEFT)
+        controller.bind("<KeyPress>", self.handle_key, add="+")
+        self.update_index(controller.to_label)
+
+    def update_index(self, index: int):
+        """
+        Show image index on the page without rebuilding any widgets
+        """
+        self.index = index
+        self.heading_text.configure(text="%d.jpeg" % index)
+        # Served from the image cache, then queue the images the user is going to see next
+        raw_image = self.controller.image_cache.get(index)
+        if self.controller.queue is not None and self.controller.direction == 1:
+            self.controller.image_cache.prefetch_indices(self.controller.queue.peek(self.controller.image_cache.prefetch_count))
+        else:
+            self.controller.image_cache.prefetch(index, self.controller.direction)
+        self.current_img = ImageTk.PhotoImage(raw_image)
+        self.image_label.configure(image=self.current_img)
+        for variable, value in zip(self.intvar, self.initialize_labels()):
+            variable.set(value)
         self.set_button_state()
 
+    def handle_key(self, event):
+        """
+        Keyboard shortcuts, only active while the labelling page is shown
+        """
+        if self.controller.current_page is not self or isinstance(event.widget, tk.Entry):
+            return
+        if event.keysym in self.SHORTCUT_KEYS:
+            variable = self.intvar[self.SHORTCUT_KEYS.index(event.keysym)]
+            variable.set(1 - variable.get())
+        elif event.keysym in ("Right", "Return") and self.next_button.cget("state") == "normal":
+            self.submit(True)
+        elif event.keysym == "Left" and self.prev_button.cget("state") == "normal":
+            self.submit(False)
+        elif event.keysym == "Escape":
+            self.controller.show_page(MainMenuPage)
+
     def set_button_state(self):
-        if self.index == 0:
+        if self.index == 0 and not self.controller.history:
             self.prev_button.configure(state="disabled")
         else:
             self.prev_button.configure(state="normal")
-        if self.index > 54007:
+        if self.index > 54007 and (self.controller.queue is None or not self.controller.queue.peek(1)):
             self.next_button.configure(state="disabled")
         else:
             self.next_button.configure(state="normal")
 
     def submit(self, state: bool):
         """
-        Save the labels created by the user locally (not saved into file)
+        Save the labels created by the user into the label journal
         Depending on the state parameter:
         True = go to next page
         False = go to previous page
         """
-        self.controller.label_data["label"][self.index] = str([i.get() for i in self.intvar])
-        print(self.controller.label_data["label"][self.index])
-        if state:
-            self.controller.to_label += 1
-        else:
-            self.controller.to_label -= 1
-        self.controller.show_page(LabellingPage)
+        self.controller.journal.record(self.index, [i.get() for i in self.intvar])
+        print(self.controller.label_data.get(self.index))
+        self.controller.direction = 1 if state else -1
+        self.controller.to_label = self.controller.next_index(self.index, state)
+        self.update_index(self.controller.to_label)
 
     def initialize_labels(self):
         """
         Returns label if it already exists in labels.csv
         otherwise returns a list of 12 integers with the value of 0
         """
-        if self.controller.check_if_labelled(self.index):
-            return eval(self.controller.label_data["label"][self.index])
+        labels = self.controller.label_data.get(self.index)
+        if labels is not None:
+            return labels
         return [0 for i in range(len(self.controller.label_names))]
     
     def create_switches(self):
@@ -285,7 +394,7 @@ class LabellingPage(tk.Frame):
                 if idx == 11:
                     return
                 frametest = tk.Frame(frame, highlightbackground="black", highlightthickness=1)
-                switch = tk.Checkbutton(frametest, text=label_names[idx], variable=self.intvar[idx])
+                switch = tk.Checkbutton(frametest, text="%s (%s)" % (label_names[idx], self.SHORTCUT_TEXT[idx]), variable=self.intvar[idx])
                 frametest.grid(row=i, column=j, sticky="nsew")
                 switch.pack(side=tk.LEFT)
                 frame.columnconfigure(j, minsize=106)
@@ -302,6 +411,7 @@ class Application(tk.Tk):
         'Hydrant', 'Motorcycle', 'Stairs', 'Tractors',
         'Traffic Light', 'Other'
     ]
+    IMAGE_COUNT = 54108
 
     @property
     def label_names(self):
@@ -312,25 +422,60 @@ class Application(tk.Tk):
         self.title("CAPTCHA multi-labelling application")
         self.geometry("800x700")
         self.resizable(False, False)
-        self.label_data = pd.read_csv("../data/labels.csv")
+        self.label_data = LabelStore.from_csv("../data/labels.csv", len(self.LABEL_NAMES), self.IMAGE_COUNT)
+        # Labels submitted since the last save are recovered from the journal
+        self.journal = LabelJournal("../data/labels.journal", self.label_data, "../data/labels.csv")
+        self.journal.replay()
+        self.journal.start()
         self.protocol("WM_DELETE_WINDOW", self.exit_app)
+        self.image_cache = ImageCache("../data/images/%d.jpeg", (400, 400), self.IMAGE_COUNT)
         self.current_page = None
+        self.labelling_page = None
         self.to_label = None
+        self.direction = 1
+        # Most uncertain images first when captcha_tools.activequeue has ranked the unlabelled pool
+        self.queue = LabelQueue("../data/uncertainty.npy", self.label_data) if os.path.exists("../data/uncertainty.npy") else None
+        self.history = []
         self.show_page(MainMenuPage)
     
     def show_page(self, page_class):
         """
         Change page into the page_class passed through the argument
+        The labelling page is only hidden when leaving it and reused on the next visit
         """
-        if self.current_page:
+        if self.current_page and self.current_page is self.labelling_page:
+            self.current_page.pack_forget()
+        elif self.current_page:
             self.current_page.destroy()
-        self.current_page = page_class(self)
+        if page_class is LabellingPage and self.labelling_page:
+            self.labelling_page.pack(fill=tk.BOTH, padx=(20, 20))
+            self.labelling_page.update_index(self.to_label)
+            self.current_page = self.labelling_page
+        else:
+            self.current_page = page_class(self)
+            if page_class is LabellingPage:
+                self.labelling_page = self.current_page
+
+    def next_index(self, index: int, forward: bool) -> int:
+        """
+        Image to show after index: the most uncertain unlabelled image of the queue going forward,
+        retracing the images popped from it going back, or simply the neighbouring index without a queue
+        """
+        if self.queue is None:
+            return index + (1 if forward else -1)
+        if not forward:
+            return self.history.pop() if self.history else max(index - 1, 0)
+        queued = self.queue.pop()
+        if queued is None:
+            return index + 1
+        self.history.append(index)
+        return queued
 
     def save_csv(self):
         """
         Save current labels progress into the csv
         """
-        self.label_data.to_csv("../data/labels.csv", index=False)
+        self.journal.compact()
 
     def exit_app(self):
         """
@@ -338,7 +483,7 @@ class Application(tk.Tk):
         """
         query = messagebox.askquestion("Exit Application", "Are you sure you want to save and exit?")
         if query == "yes":
-            self.save_csv()
+            self.journal.close()
             self.destroy()
 
     def check_if_labelled(self, index: int) -> bool:
@@ -346,9 +491,7 @@ class Application(tk.Tk):
         Check if an image index is already labeled
         returns Boolean
         """
-        if self.label_data["label"].isnull().values[index]:
-            return False
-        return True
+        return self.label_data.is_labelled(index)
             
 # MAIN DRIVER
 if __name__ == "__main__":
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# The tools are imported the way the notebooks and CLIs use them, as captcha_tools from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+class FakeModel():
+    """
+    Stand-in for a keras model: every image scores value in every class
+    """
+
+    def __init__(self, value=0.5, classes=9):
+        self.value = value
+        self.output_shape = (None, classes)
+        self.calls = 0
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        self.calls += 1
+        return np.full((len(batch), self.output_shape[-1]), self.value, dtype=np.float32)
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    """
+    Twelve small jpeg files
+    """
+    paths = []
+    for i in range(12):
+        path = str(tmp_path / ("%d.jpeg" % i))
+        Image.fromarray(np.full((100, 100, 3), i * 20, dtype=np.uint8)).save(path)
+        paths.append(path)
+    return paths
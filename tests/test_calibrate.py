@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from captcha_tools.calibrate import best_thresholds, sweep, truth_columns
+from captcha_tools.compare import LABEL_NAMES, MODELS
+
+
+def brute_force(scores, truth, thresholds):
+    precision, recall = [], []
+    for threshold in thresholds:
+        predicted = scores >= threshold
+        true_positives = np.sum(predicted & truth)
+        precision.append(true_positives / predicted.sum() if predicted.sum() else 1.0)
+        recall.append(true_positives / truth.sum() if truth.sum() else 0.0)
+    return np.array(precision), np.array(recall)
+
+
+def test_sweep_matches_brute_force():
+    generator = np.random.default_rng(0)
+    scores = generator.random(500).round(2)
+    truth = generator.random(500) < scores
+    thresholds = np.linspace(0, 1, 101)[1:]
+    precision, recall, f1 = sweep(scores, truth.astype(np.int64), thresholds)
+    expected_precision, expected_recall = brute_force(scores, truth, thresholds)
+    np.testing.assert_allclose(precision, expected_precision)
+    np.testing.assert_allclose(recall, expected_recall)
+
+
+def test_best_thresholds_separable_classes():
+    scores = np.array([[0.9, 0.2], [0.8, 0.7], [0.1, 0.6], [0.3, 0.1]])
+    truth = np.array([[1, 0], [1, 1], [0, 1], [0, 0]])
+    best, (precision, recall, f1) = best_thresholds(scores, truth, np.linspace(0, 1, 101)[1:])
+    assert 0.3 < best[0] <= 0.8 and 0.2 < best[1] <= 0.6
+    np.testing.assert_allclose(f1, 1.0)
+
+
+def test_truth_columns_by_name():
+    columns = truth_columns(MODELS["multi"]["label_names"])
+    # Tractors is a labels.csv column the multi-label model does not have
+    assert [LABEL_NAMES[i] for i in columns] == MODELS["multi"]["label_names"]
+    assert columns[-1] == LABEL_NAMES.index("Traffic Light")
+
+
+def test_truth_columns_unknown_class():
+    with pytest.raises(ValueError):
+        truth_columns(MODELS["single"]["label_names"])
@@ -0,0 +1,52 @@
+import numpy as np
+
+from captcha_tools.compare import LABEL_NAMES, MODELS, class_metrics, diff, evaluate
+
+
+def test_class_metrics():
+    decisions = np.array([[True, False], [True, True], [False, False]])
+    truth = np.array([[1, 0], [0, 1], [0, 1]])
+    metrics = class_metrics(decisions, truth)
+    np.testing.assert_allclose(metrics["precision"], [0.5, 1.0])
+    np.testing.assert_allclose(metrics["recall"], [1.0, 0.5])
+    np.testing.assert_allclose(metrics["accuracy"], [2 / 3, 2 / 3])
+    assert metrics["support"].tolist() == [1, 2]
+
+
+def test_evaluate_matches_classes_by_name():
+    names = MODELS["multi"]["label_names"]
+    truth = np.zeros((4, len(LABEL_NAMES)), dtype=np.uint8)
+    truth[0, LABEL_NAMES.index("Traffic Light")] = 1
+    truth[1, LABEL_NAMES.index("Tractors")] = 1
+    scores = np.zeros((4, len(names)), dtype=np.float32)
+    scores[0, names.index("Traffic Light")] = 0.9
+    result = evaluate(scores, truth, names, 0.5, single_label=False)
+    assert "Tractors" not in result
+    assert result["Traffic Light"]["recall"] == 1.0
+    assert result["Traffic Light"]["precision"] == 1.0
+
+
+def test_evaluate_single_label_argmax():
+    names = MODELS["single"]["label_names"]
+    truth = np.zeros((1, len(LABEL_NAMES)), dtype=np.uint8)
+    truth[0, LABEL_NAMES.index("Bus")] = 1
+    scores = np.zeros((1, len(names)), dtype=np.float32)
+    scores[0, names.index("Bus")] = 0.6
+    scores[0, names.index("Car")] = 0.5
+    result = evaluate(scores, truth, names, 0.2, single_label=True)
+    assert result["Bus"]["recall"] == 1.0
+    assert result["Car"]["precision"] == 1.0 and result["Car"]["accuracy"] == 1.0
+
+
+def run(f1, p50):
+    return {"models": {"multi": {
+        "classes": {"Bus": {"accuracy": 0.9, "precision": 0.9, "recall": 0.9, "f1": f1}},
+        "latency": {"9": {"p50_ms": p50, "p95_ms": p50, "p99_ms": p50}},
+    }}}
+
+
+def test_diff_reports_regressions():
+    assert diff(run(0.8, 10.0), run(0.8, 11.0)) == []
+    regressions = diff(run(0.8, 10.0), run(0.7, 13.0))
+    assert len(regressions) == 4
+    assert regressions[0].startswith("multi Bus f1")
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from captcha_tools.decision import DEFAULT_THRESHOLD, argmax_mask, decide, model_thresholds, save_thresholds, thresholds_path, tiles_to_click
+
+PREDICTIONS = np.array([
+    [0.9, 0.1, 0.3],
+    [0.2, 0.6, 0.5],
+    [0.1, 0.1, 0.1],
+    [0.4, 0.0, 0.45],
+])
+
+
+def test_multi_label_uses_every_score_above_threshold():
+    assert tiles_to_click(PREDICTIONS, 0, 0.3).tolist() == [0, 3]
+    assert tiles_to_click(PREDICTIONS, 2, 0.3).tolist() == [0, 1, 3]
+
+
+def test_per_class_thresholds():
+    thresholds = [0.95, 0.5, 0.5]
+    assert tiles_to_click(PREDICTIONS, 0, thresholds).tolist() == []
+    assert tiles_to_click(PREDICTIONS, 1, thresholds).tolist() == [1]
+
+
+def test_single_label_keeps_only_the_argmax():
+    assert tiles_to_click(PREDICTIONS, 2, 0.3, single_label=True).tolist() == [3]
+    assert argmax_mask(PREDICTIONS)[1].tolist() == [0.0, 0.6, 0.0]
+
+
+def test_decide_shape():
+    assert decide(PREDICTIONS, 0.5).shape == PREDICTIONS.shape
+
+
+def test_numpy_integer_label():
+    assert tiles_to_click(PREDICTIONS, np.int64(1), 0.5).tolist() == [1]
+
+
+@pytest.mark.parametrize("label", [None, 3, -1, True, 1.0, "1"])
+def test_unknown_label_raises(label):
+    with pytest.raises(ValueError):
+        tiles_to_click(PREDICTIONS, label, 0.5)
+
+
+def test_model_thresholds(tmp_path):
+    model_path = str(tmp_path / "model.h5")
+    assert model_thresholds(model_path, 3, multi_label=True).tolist() == [DEFAULT_THRESHOLD] * 3
+    save_thresholds(thresholds_path(model_path), [0.1, 0.5, 0.9])
+    assert model_thresholds(model_path, 3, multi_label=True).tolist() == [0.1, 0.5, 0.9]
+    # Single-label models decide on the argmax with the default threshold, calibrated or not
+    assert model_thresholds(model_path, 3, multi_label=False).tolist() == [DEFAULT_THRESHOLD] * 3
+    with pytest.raises(ValueError):
+        model_thresholds(model_path, 4, multi_label=True)
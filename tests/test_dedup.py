@@ -0,0 +1,55 @@
+import numpy as np
+
+from captcha_tools.dedup import cluster, group_split, hamming, near_duplicate_pairs
+
+
+def brute_pairs(hashes, radius):
+    pairs = []
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            if bin(int(hashes[i]) ^ int(hashes[j])).count("1") <= radius:
+                pairs.append([i, j])
+    return pairs
+
+
+def flip_bits(value, bits):
+    for bit in bits:
+        value ^= 1 << int(bit)
+    return value
+
+
+def test_hamming():
+    a = np.array([0, 0xFF, 2 ** 64 - 1], dtype=np.uint64)
+    b = np.array([1, 0, 0], dtype=np.uint64)
+    assert hamming(a, b).tolist() == [1, 8, 64]
+
+
+def test_pairs_match_brute_force():
+    rng = np.random.default_rng(3)
+    values = [int(i) for i in rng.integers(0, 2 ** 63, 60, dtype=np.uint64)]
+    # Near copies of the first images, some just inside and some just outside the radius
+    for i, flips in enumerate((1, 3, 6, 7, 6, 9, 2, 0)):
+        values.append(flip_bits(values[i], rng.choice(64, flips, replace=False)))
+    values.append(0)
+    values.append(flip_bits(0, range(6)))
+    hashes = np.array(values, dtype=np.uint64)
+    for radius in (2, 6):
+        assert near_duplicate_pairs(hashes, radius).tolist() == brute_pairs(hashes, radius)
+    assert near_duplicate_pairs(hashes, 6, block=2).tolist() == brute_pairs(hashes, 6)
+    assert near_duplicate_pairs(np.zeros(0, dtype=np.uint64)).shape == (0, 2)
+
+
+def test_cluster():
+    pairs = np.array([[3, 5], [5, 8], [1, 2], [8, 9], [0, 9]])
+    assert cluster(11, pairs).tolist() == [0, 1, 1, 0, 4, 0, 6, 7, 0, 0, 10]
+    assert cluster(3, np.zeros((0, 2), dtype=np.int64)).tolist() == [0, 1, 2]
+
+
+def test_group_split_keeps_clusters_together():
+    rng = np.random.default_rng(0)
+    groups = np.sort(rng.integers(0, 150, 1000))
+    train, test = group_split(groups, 0.2, seed=1)
+    assert not set(groups[train]) & set(groups[test])
+    assert sorted(np.concatenate((train, test)).tolist()) == list(range(1000))
+    assert abs(len(test) - 200) < 30
+    assert len(group_split(groups, 0.0)[1]) == 0
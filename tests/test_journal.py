@@ -0,0 +1,89 @@
+import os
+
+from captcha_tools.journal import RECORD, LabelJournal
+from captcha_tools.labels import LabelStore
+
+
+def new_csv(tmp_path, count=20, labels=3):
+    path = str(tmp_path / "labels.csv")
+    LabelStore(count, labels).to_csv(path)
+    return path
+
+
+def reopen(tmp_path, csv_path, labels=3):
+    store = LabelStore.from_csv(csv_path, labels)
+    journal = LabelJournal(str(tmp_path / "labels.journal"), store, csv_path)
+    return store, journal
+
+
+def test_replay_onto_csv(tmp_path):
+    csv_path = new_csv(tmp_path)
+    store, journal = reopen(tmp_path, csv_path)
+    journal.record(3, [1, 0, 1])
+    journal.record(7, [0, 1, 0])
+    journal.record(7, None)
+    journal.close(compact=False)
+
+    store, journal = reopen(tmp_path, csv_path)
+    assert store.get(3) is None
+    assert journal.replay() == 3
+    assert store.get(3) == [1, 0, 1]
+    assert store.get(7) is None
+    journal.close()
+    assert LabelStore.from_csv(csv_path, 3).get(3) == [1, 0, 1]
+    assert os.path.getsize(str(tmp_path / "labels.journal")) == 0
+
+
+def test_torn_trailing_record_is_dropped(tmp_path):
+    csv_path = new_csv(tmp_path)
+    journal_path = str(tmp_path / "labels.journal")
+    with open(journal_path, "wb") as file:
+        file.write(RECORD.pack(2, 0b11, 1))
+        file.write(RECORD.pack(5, 0b1, 1)[:RECORD.size - 1])
+    store, journal = reopen(tmp_path, csv_path)
+    assert os.path.getsize(journal_path) == RECORD.size
+    journal.record(9, [0, 0, 1])
+    journal.close(compact=False)
+
+    store, journal = reopen(tmp_path, csv_path)
+    assert journal.replay() == 2
+    assert store.get(2) == [1, 1, 0]
+    assert store.get(5) is None
+    assert store.get(9) == [0, 0, 1]
+    journal.close(compact=False)
+
+
+def test_recovers_compaction_interrupted_before_replace(tmp_path):
+    csv_path = new_csv(tmp_path)
+    journal_path = str(tmp_path / "labels.journal")
+    store, journal = reopen(tmp_path, csv_path)
+    journal.record(1, [1, 0, 0])
+    journal.close(compact=False)
+    # Crash after the journal was rotated, before the csv replaced labels.csv
+    os.replace(journal_path, journal_path + ".compacting")
+    with open(csv_path + ".tmp", "w") as file:
+        file.write("index,label\n0,")
+
+    store, journal = reopen(tmp_path, csv_path)
+    assert journal.replay() == 1
+    journal.record(4, [0, 1, 1])
+    assert store.get(1) == [1, 0, 0]
+    journal.compact()
+    journal.close(compact=False)
+    assert not os.path.exists(journal_path + ".compacting")
+    saved = LabelStore.from_csv(csv_path, 3)
+    assert saved.get(1) == [1, 0, 0]
+    assert saved.get(4) == [0, 1, 1]
+
+
+def test_compacts_only_after_new_records(tmp_path):
+    csv_path = new_csv(tmp_path)
+    written = os.stat(csv_path).st_mtime_ns
+    store, journal = reopen(tmp_path, csv_path)
+    journal.start(sync_interval=0.01, compact_interval=0.02)
+    journal._stop.wait(0.2)
+    assert os.stat(csv_path).st_mtime_ns == written
+    journal.record(6, [1, 1, 1])
+    journal._stop.wait(0.2)
+    journal.close(compact=False)
+    assert LabelStore.from_csv(csv_path, 3).get(6) == [1, 1, 1]
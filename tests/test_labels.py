@@ -0,0 +1,95 @@
+import numpy as np
+
+from captcha_tools.labels import LabelStore
+
+
+def test_set_clear_get():
+    store = LabelStore(10, 11)
+    assert store.get(4) is None
+    store.set(4, [1] + [0] * 9 + [1])
+    assert store.masks[4] == 0b10000000001
+    assert store.get(4) == [1] + [0] * 9 + [1]
+    store.set(4, [0] * 11)
+    assert store.get(4) == [0] * 11
+    assert store.is_labelled(4)
+    store.clear(4)
+    assert store.get(4) is None
+    assert store.masks[4] == 0
+
+
+def test_sixteen_labels_fit_the_mask():
+    store = LabelStore(3, 16)
+    store.set(2, [1] * 16)
+    assert store.masks.dtype == np.uint16
+    assert store.get(2) == [1] * 16
+
+
+def test_labelled_bitmap():
+    store = LabelStore(20, 3)
+    for index in (0, 7, 8, 19):
+        store.set(index, [1, 0, 0])
+    store.set(8, [0, 1, 0])
+    store.clear(7)
+    assert np.flatnonzero(store.labelled_mask()).tolist() == [0, 8, 19]
+    assert store.unlabelled_total() == 17
+    assert store.matrix([0, 8]).tolist() == [[1, 0, 0], [0, 1, 0]]
+
+
+def test_csv_round_trip(tmp_path):
+    path = str(tmp_path / "labels.csv")
+    store = LabelStore(6, 11)
+    store.set(0, [1] + [0] * 10)
+    store.set(3, [0, 0, 0, 1] + [0] * 6 + [1])
+    store.set(5, [0] * 11)
+    store.to_csv(path)
+    loaded = LabelStore.from_csv(path, 11)
+    assert len(loaded) == 6
+    assert [loaded.get(i) for i in range(6)] == [store.get(i) for i in range(6)]
+    assert np.array_equal(loaded.labelled, store.labelled)
+
+
+def test_reads_legacy_quoted_rows(tmp_path):
+    path = tmp_path / "labels.csv"
+    path.write_text(
+        'index,label\n'
+        '"0,""[1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]"""\n'
+        '"1,""[0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1]"""\n'
+        '2,\n'
+        '3,nan\n'
+        '4,"[0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0]"\n'
+    )
+    store = LabelStore.from_csv(str(path), 11, count=8)
+    assert len(store) == 8
+    assert store.get(0) == [1] + [0] * 10
+    assert store.get(1) == [0, 0, 0, 1] + [0] * 6 + [1]
+    assert store.get(2) is None and store.get(3) is None
+    assert store.get(4) == [0, 1] + [0] * 9
+    store.to_csv(str(path))
+    assert path.read_text().splitlines()[1:3] == ['0,"[1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]"', '1,"[0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1]"']
+
+
+def brute_unlabelled(store):
+    return [i for i in range(len(store)) if store.get(i) is None]
+
+
+def test_rank_and_select_match_a_scan():
+    # Two full 512-row blocks and a partial last one
+    store = LabelStore(1300, 3)
+    rng = np.random.default_rng(0)
+    for index in rng.choice(1300, 700, replace=False):
+        store.set(int(index), [1, 0, 0])
+    for index in (0, 511, 512, 1023, 1024, 1299):
+        store.set(index, [0, 1, 0])
+    store.clear(511)
+    store.clear(1299)
+    # A fully labelled block is skipped through the counts
+    for index in range(512, 1024):
+        store.set(index, [0, 0, 1])
+    unlabelled = brute_unlabelled(store)
+    assert store.unlabelled_total() == len(unlabelled)
+    for index in (0, 1, 510, 511, 512, 513, 1023, 1024, 1025, 1298, 1299, 1300, 5000, -3):
+        assert store.rank_unlabelled(index) == sum(i < index for i in unlabelled)
+    for rank in range(len(unlabelled)):
+        assert store.select_unlabelled(rank, 4).tolist() == unlabelled[rank:rank + 4]
+    assert len(store.select_unlabelled(len(unlabelled), 4)) == 0
+    assert store.select_unlabelled(len(unlabelled) - 1, 4).tolist() == [1299]
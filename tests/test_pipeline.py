@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from captcha_tools.pipeline import ArraySource, training_dataset
+
+
+def test_cached_batches_mix_classes():
+    # Written class by class like the single-label build
+    count, classes = 4000, 4
+    labels = np.repeat(np.eye(classes, dtype=np.uint8), count // classes, axis=0)
+    images = np.zeros((count, 2, 2, 3), dtype=np.uint8)
+    source = ArraySource(images, labels)
+    train, test = source.split(test_size=0.1)
+    data = training_dataset(source, train, batch_size=32, training=True, augment=False, cache="", shuffle_buffer=64)
+    mixed = [len(np.unique(np.argmax(batch_labels.numpy(), axis=1))) for _, batch_labels in data]
+    assert np.mean(mixed) > 3
+    seen = np.concatenate([batch_labels.numpy() for _, batch_labels in data])
+    assert len(seen) == len(train)
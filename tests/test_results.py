@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from captcha_tools.results import HEADER_SIZE, RESULT_DTYPE, ResultLog, _header, read_results, summarize
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "results.rec"
+    path.write_bytes(b"not a results log".ljust(HEADER_SIZE))
+    with pytest.raises(ValueError):
+        ResultLog(str(path))
+    with pytest.raises(ValueError):
+        read_results(str(path))
+
+
+def test_rejects_other_record_layout(tmp_path):
+    path = tmp_path / "results.rec"
+    path.write_bytes(_header(np.dtype([("timestamp", "<f8"), ("verify_count", "i1")])))
+    with pytest.raises(ValueError):
+        ResultLog(str(path))
+
+
+def test_torn_final_record_is_truncated(tmp_path):
+    path = str(tmp_path / "results.rec")
+    log = ResultLog(path)
+    log.append("model.h5", "multi", "Bus", 2)
+    log.close()
+    with open(path, "ab") as file:
+        file.write(b"\1" * (RESULT_DTYPE.itemsize // 2))
+    assert len(read_results(path)) == 1
+    log = ResultLog(path)
+    log.append("model.h5", "multi", "Car", 0)
+    log.close()
+    results = read_results(path)
+    assert results["label"].tolist() == [b"Bus", b"Car"]
+    assert results["verify_count"].tolist() == [2, 0]
+
+
+def test_summarize(tmp_path):
+    path = str(tmp_path / "results.rec")
+    log = ResultLog(path)
+    log.append("a/multi.h5", "multi", "Bus", 2, attempt_ms=100, stages={"predict": 10}, run=1.0)
+    log.append("a/multi.h5", "multi", "Bus", 4, attempt_ms=300, stages={"predict": 30}, run=1.0)
+    log.append("a/multi.h5", "multi", "Car", 0, attempt_ms=200, run=2.0)
+    log.append("single.h5", "single", "Car", 0)
+    log.close()
+    summary = summarize(read_results(path))
+    assert set(summary) == {"multi multi.h5", "single single.h5"}
+    multi = summary["multi multi.h5"]
+    assert multi["attempts"] == 3
+    assert multi["runs"] == 2
+    assert multi["success_rate"] == pytest.approx(2 / 3)
+    assert multi["mean_verify_count"] == 3.0
+    assert multi["solved_labels"] == {"Bus": 2}
+    assert multi["mean_ms"]["attempt_ms"] == 200.0
+    assert multi["mean_ms"]["predict_ms"] == 20.0
+    assert multi["mean_ms"]["wait_ms"] is None
+    single = summary["single single.h5"]
+    assert single["runs"] == 0
+    assert single["mean_verify_count"] is None
+    assert summarize(np.zeros(0, dtype=RESULT_DTYPE)) == {}
@@ -0,0 +1,59 @@
+import threading
+
+import numpy as np
+import pytest
+
+from captcha_tools.score import paths_hash, score_images
+
+from conftest import FakeModel
+
+
+def model_file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_resumes_same_model_and_paths(tmp_path, image_paths):
+    model_path = model_file(tmp_path, "model.h5", b"first")
+    output = str(tmp_path / "scores.npy")
+    score_images(FakeModel(0.25), image_paths, output, batch_size=4, model_path=model_path)
+    model = FakeModel(0.75)
+    scores = score_images(model, image_paths, output, batch_size=4, model_path=model_path)
+    assert model.calls == 0
+    assert np.all(np.asarray(scores) == 0.25)
+
+
+def test_rescores_after_retrain(tmp_path, image_paths):
+    model_path = model_file(tmp_path, "model.h5", b"first")
+    output = str(tmp_path / "scores.npy")
+    score_images(FakeModel(0.25), image_paths, output, batch_size=4, model_path=model_path)
+    model_file(tmp_path, "model.h5", b"retrained")
+    scores = score_images(FakeModel(0.75), image_paths, output, batch_size=4, model_path=model_path)
+    assert np.all(np.asarray(scores) == 0.75)
+
+
+def test_rescores_other_paths_of_same_length(tmp_path, image_paths):
+    model_path = model_file(tmp_path, "model.h5", b"first")
+    output = str(tmp_path / "scores.npy")
+    score_images(FakeModel(0.25), image_paths, output, batch_size=4, model_path=model_path)
+    scores = score_images(FakeModel(0.75), image_paths[::-1], output, batch_size=4, model_path=model_path)
+    assert np.all(np.asarray(scores) == 0.75)
+
+
+def test_paths_hash_depends_on_order():
+    assert paths_hash(["a", "b"]) != paths_hash(["b", "a"])
+    assert paths_hash(["ab"]) != paths_hash(["a", "b"])
+
+
+class FailingModel(FakeModel):
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        raise RuntimeError("predict failed")
+
+
+def test_failing_predict_does_not_hang(tmp_path, image_paths):
+    output = str(tmp_path / "scores.npy")
+    with pytest.raises(RuntimeError):
+        score_images(FailingModel(), image_paths, output, batch_size=1, queue_size=1)
+    assert not [i for i in threading.enumerate() if i is not threading.main_thread() and i.is_alive() and i.daemon]
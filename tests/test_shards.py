@@ -0,0 +1,23 @@
+import numpy as np
+
+from captcha_tools.shards import ShardedDataset, split_indices, write_shards
+
+
+def test_split_indices():
+    train, test = split_indices(100, 0.25, seed=1)
+    assert len(test) == 25
+    assert np.all(np.diff(train) > 0) and np.all(np.diff(test) > 0)
+    assert sorted(np.concatenate((train, test)).tolist()) == list(range(100))
+    assert np.array_equal(split_indices(100, 0.25, seed=1)[1], test)
+    groups = np.arange(100) // 10
+    train, test = split_indices(100, 0.25, seed=1, groups=groups)
+    assert not set(groups[train]) & set(groups[test])
+
+
+def test_dataset_split_uses_split_indices(tmp_path):
+    images = np.zeros((30, 2, 2, 3), dtype=np.uint8)
+    labels = np.eye(3, dtype=np.uint8)[np.arange(30) % 3]
+    write_shards(images, labels, str(tmp_path), shard_size=8)
+    dataset = ShardedDataset(str(tmp_path))
+    for result, expected in zip(dataset.split(0.2, seed=5), split_indices(30, 0.2, seed=5)):
+        assert np.array_equal(result, expected)